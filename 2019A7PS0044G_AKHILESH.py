@@ -4,21 +4,36 @@ from numpy import all, array, uint8
 import random
 import copy
 import matplotlib.pyplot as plt
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, namedtuple
 import math
+import itertools
 import gzip, json
+import asyncio
+import os, sys, time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, as_completed
 
 #####################################################
 # read Q Values
 # with gzip.open('./2019A7PS0044G_AKHILESH.dat.gz', 'rb') as f:
 #             file = f.read()
 #             algo2.Q = json.loads(file.decode('utf-8'))
+# or from the binary table written by QLearning.saveTable
+# algo2.loadTable('./2019A7PS0044G_AKHILESH.q.npy')
 ######################################################3
 
+#symmetric=True hashes the board and its mirror image the same way, mirrored tells whether the
+#stored board is the mirror image (actions then have to go through Connect4.mirrorAction)
 class hashable(object):
-    def __init__(self, wrapped):
+    def __init__(self, wrapped, symmetric=False):
+        wrapped = np.asarray(wrapped)
+        self.mirrored = False
+        if symmetric:
+            flipped = np.ascontiguousarray(wrapped[:, ::-1])
+            if flipped.tobytes() < wrapped.tobytes():
+                wrapped = flipped
+                self.mirrored = True
         self.__wrapped = array(wrapped)
-        self.__hash = int(sha1(wrapped.view(uint8)).hexdigest(), 16)
+        self.__hash = int(sha1(np.ascontiguousarray(wrapped).view(uint8)).hexdigest(), 16)
 
     def __eq__(self, other):
         return all(self.__wrapped == other.__wrapped)
@@ -31,6 +46,8 @@ class hashable(object):
 
 ################################################
 class Node:
+    __slots__ = ('state', 'parent', 'action', 'player', 'children', 'visits', 'score', 'moves', 'terminal', 'winner', 'key')
+
     def __init__(self, state, parent, action, player):
         self.state = state
         self.parent = parent
@@ -39,86 +56,886 @@ class Node:
         self.children = []
         self.visits = 0
         self.score = 0
+        self.moves = 0 #pieces on the board
+        self.terminal = False
+        self.winner = -1
+        self.key = 0 #zobrist hash of the board, only set when a transposition table is used
+################################################
+#shares nodes between move orders that reach the same board, least recently used entries
+#are dropped once max_size is reached (the nodes stay in the tree, they just stop being shared)
+class TranspositionTable():
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        node = self.table.get(key)
+        if node is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.table.move_to_end(key)
+        return node
+
+    def put(self, key, node):
+        self.table[key] = node
+        if len(self.table) > self.max_size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.table.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.table), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits/lookups if lookups else 0.0}
+################################################
+#Rollout policies
+#chooseMove(game, board, player, legal_moves) picks the next move of a playout; board is left as
+#it was found. MCTS and RandomPlayer take a policy object or one of the names in ROLLOUT_POLICIES
+
+class RandomPolicy():
+    def chooseMove(self, game, board, player, legal_moves):
+        return random.choice(legal_moves)
+
+
+#random, with the middle columns weighted up: a column's weight falls off linearly with its
+#distance from the middle, the edge columns keep 1
+class CenterPolicy():
+    def __init__(self):
+        self.cum_weights = {} #(COLUMN_COUNT, legal moves) -> cumulative weights
+
+    def chooseMove(self, game, board, player, legal_moves):
+        key = (game.COLUMN_COUNT, tuple(legal_moves))
+        cum_weights = self.cum_weights.get(key)
+        if cum_weights is None:
+            middle = (game.COLUMN_COUNT - 1)/2
+            cum_weights = list(itertools.accumulate(middle + 1 - abs(col - middle) for col in legal_moves))
+            self.cum_weights[key] = cum_weights
+        return random.choices(legal_moves, cum_weights=cum_weights)[0]
+
+
+#plays a move that wins right away, otherwise blocks a column where the opponent would win,
+#otherwise asks fallback (random by default)
+class WinBlockPolicy():
+    def __init__(self, fallback=None):
+        self.fallback = RandomPolicy() if fallback is None else fallback
+
+    def chooseMove(self, game, board, player, legal_moves):
+        wins = game.winningMoves(board, player)
+        if wins:
+            return wins[0]
+        blocks = game.winningMoves(board, game.nextPlayer(player))
+        if blocks:
+            return blocks[0]
+        return self.fallback.chooseMove(game, board, player, legal_moves)
+
+
+#searches plies moves ahead for forced wins only: every move scores 1 (wins), -1 (the opponent
+#can force a win) or 0, and a random move among the best is played. plies=2 wins, blocks and
+#avoids moves that let the opponent win on top of them
+class LookaheadPolicy():
+    def __init__(self, plies=2):
+        self.plies = plies
+
+    def chooseMove(self, game, board, player, legal_moves):
+        wins = game.winningMoves(board, player)
+        if wins:
+            return wins[0]
+        if self.plies <= 1:
+            return random.choice(legal_moves)
+        opponent = game.nextPlayer(player)
+        best, best_moves = -2, []
+        for col in legal_moves:
+            game.dropPiece(board, col, player)
+            value = -self.positionValue(game, board, opponent, self.plies - 1)
+            game.unplayMove(board, col)
+            if value > best:
+                best, best_moves = value, [col]
+            elif value == best:
+                best_moves.append(col)
+        return random.choice(best_moves)
+
+    #1 if player (to move) can force a win within plies moves, -1 if the opponent can, else 0
+    def positionValue(self, game, board, player, plies):
+        if game.winningMoves(board, player):
+            return 1
+        replies = game.validMoves(board)
+        if plies <= 1 or not replies:
+            return 0
+        opponent = game.nextPlayer(player)
+        best = -1
+        for col in replies:
+            game.dropPiece(board, col, player)
+            best = max(best, -self.positionValue(game, board, opponent, plies - 1))
+            game.unplayMove(board, col)
+            if best == 1:
+                break
+        return best
+
+
+ROLLOUT_POLICIES = {'random': RandomPolicy, 'center': CenterPolicy, 'winblock': WinBlockPolicy,
+                    'winblock_center': lambda: WinBlockPolicy(CenterPolicy()), 'lookahead': LookaheadPolicy}
+
+
+def makePolicy(policy):
+    if policy is None or not isinstance(policy, str):
+        return policy
+    if policy not in ROLLOUT_POLICIES:
+        raise ValueError("unknown rollout policy " + policy)
+    return ROLLOUT_POLICIES[policy]()
+
 ################################################
+#policy is a rollout policy (see above), random moves by default
 class RandomPlayer():
-    def __init__(self, game, player):
+    def __init__(self, game, player, policy=None):
         self.game = game
         self.player = player
+        self.policy = makePolicy(policy)
 
     def bestMove(self, state, player):
+        if self.policy is not None:
+            return self.policy.chooseMove(self.game, state, player, self.game.validMoves(state))
         return random.choice(self.game.validMoves(state))
 ################################################
+#per-move timers and counters for an MCTS search. instrument() replaces the search methods of one
+#agent (and the terminal checks of its game copy) with timing wrappers, so an agent created without
+#stats runs the plain methods and pays nothing. phase times are exclusive; full board scans by
+#checkTerminalState are timed under terminal_check, the per-move checkLastMove calls are only
+#counted (timing every ply of every playout costs more than the check) so their time stays in
+#expand and playout
+class SearchStats():
+    PHASES = ('select', 'expand', 'playout', 'backpropagate', 'terminal_check')
+
+    def __init__(self):
+        self.last = None #stats of the latest move, see record
+        self.seconds = {}
+        self.calls = {}
+        self.reset()
+
+    #cleared in place, the wrappers hold on to the dicts
+    def reset(self):
+        for phase in SearchStats.PHASES:
+            self.seconds[phase] = 0.0
+            self.calls[phase] = 0
+        self.nested = 0.0
+        self.playout_moves = 0
+        self.longest_playout = 0
+
+    def timed(self, phase, method):
+        def wrapper(*args, **kwargs):
+            outer = self.nested
+            self.nested = 0.0
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            self.seconds[phase] += elapsed - self.nested
+            self.calls[phase] += 1
+            self.nested = outer + elapsed
+            return result
+        return wrapper
+
+    def counted(self, method):
+        calls = self.calls
+
+        def wrapper(*args):
+            calls['terminal_check'] += 1
+            return method(*args)
+        return wrapper
+
+    def instrument(self, algo):
+        for phase, name in (('select', 'select'), ('expand', 'expand'), ('backpropagate', 'backpropagate'),
+                            ('backpropagate', 'backpropagatePath')):
+            setattr(algo, name, self.timed(phase, getattr(algo, name)))
+        if algo.workers == 1: #the game is sent to the worker processes, the wrappers cannot be pickled
+            algo.game.checkTerminalState = self.timed('terminal_check', algo.game.checkTerminalState)
+            algo.game.checkLastMove = self.counted(algo.game.checkLastMove)
+        evaluate = self.timed('playout', algo.evaluateLeaf)
+        algo.evaluateLeaves = self.timed('playout', algo.evaluateLeaves) #one call per evaluator batch
+        search = algo.bestMove
+
+        #a playout checks for the end of the game once per move it plays
+        def evaluateLeaf(node):
+            checks = self.calls['terminal_check']
+            reward = evaluate(node)
+            length = self.calls['terminal_check'] - checks
+            self.playout_moves += length
+            self.longest_playout = max(self.longest_playout, length)
+            return reward
+
+        def bestMove(state, player, *args, **kwargs):
+            self.reset()
+            start = time.perf_counter()
+            move = search(state, player, *args, **kwargs)
+            self.last = self.record(algo, player, move, time.perf_counter() - start)
+            return move
+
+        algo.evaluateLeaf = evaluateLeaf
+        algo.bestMove = bestMove
+
+    def record(self, algo, player, move, seconds):
+        max_depth, expanded, children = algo.treeShape()
+        playouts = self.calls['playout']
+        return {'player': player, 'move': move, 'seconds': seconds, 'iterations': algo.iterations,
+                'iterations_per_sec': algo.iterations/seconds if seconds > 0 else 0.0,
+                'nodes_created': algo.nodes_created, 'max_depth': max_depth,
+                'branching_factor': children/expanded if expanded else 0.0, 'playouts': playouts,
+                'mean_playout_length': self.playout_moves/playouts if playouts else 0.0,
+                'max_playout_length': self.longest_playout, 'terminal_checks': self.calls['terminal_check'],
+                'phase_seconds': dict(self.seconds), 'phase_calls': dict(self.calls)}
+
+    #the latest move as one line of JSON
+    def jsonLine(self):
+        return json.dumps(self.last)
+
+################################################
+MAX_ITERATIONS_PER_NODE = 10 #cap on the iterations of a max_nodes search, see searchWithBudget
+
 class MCTS():
-    def __init__(self, game, n_playouts, player , C = 10*np.sqrt(2), epsilon = 0.25):
+    #compact=True keeps a single scratch board: children only store (parent, action) and
+    #playouts make/unmake moves on the scratch board instead of copying it
+    #workers > 1 searches in parallel:
+    #  parallel='root' - every worker process builds its own tree with worker_playouts playouts
+    #                    (defaults to n_playouts) and the root statistics are merged
+    #  parallel='tree' - one shared tree in this process, selection applies virtual_loss to the
+    #                    selected path and the playouts run in the worker processes
+    #batch_playouts = K evaluates every leaf with K vectorized playouts and averages the rewards
+    #reuse_tree=True keeps the subtree of the position reached after our move and the reply
+    #transpositions = N shares nodes of identical boards through a table of at most N entries,
+    #the tree becomes a DAG so rewards are backed up along the path that was selected (not with reuse_tree)
+    #time_limit (seconds) and/or max_nodes replace n_playouts with a budget, see searchWithBudget;
+    #the parallel searches cannot stop early, so they refuse a budget
+    #vectorized=True scores all children of a node with one array expression in bestChild
+    #book is an OpeningBook, positions it covers are answered without searching
+    #symmetry=True only expands one move of every mirrored pair on boards that are their own mirror image;
+    #that is the empty board and a few openings, later positions are searched in full. two different
+    #boards that mirror each other are not merged either, that would take mirrored transposition keys
+    #solver_threshold = N solves positions with at most N empty cells exactly (see Solver): such
+    #children are stored as terminal with their proven winner instead of being played out, and a
+    #root with at most N empty cells gets the solver's move. proofs are also backed up (MCTS-Solver):
+    #a node whose player to move has a proven winning child, or whose children are all proven, becomes
+    #terminal too, selection stops there and a proven root plays the move that keeps its result
+    #stats=True collects a SearchStats record for every move in self.stats.last (only the work done
+    #in this process is seen when workers > 1)
+    #policy picks the playout moves (see Rollout policies), uniformly random when None
+    #evaluator replaces the playouts with a value function (see Leaf evaluators): up to eval_batch
+    #leaves are selected with virtual_loss on their paths, scored in one call and backed up together
+    def __init__(self, game, n_playouts, player , C = 10*np.sqrt(2), epsilon = 0.25, compact = False, workers = 1, worker_playouts = None,
+                 parallel = 'root', virtual_loss = 100, batch_playouts = 0, reuse_tree = False, transpositions = 0,
+                 time_limit = None, max_nodes = None, vectorized = False, book = None, symmetry = False, solver_threshold = 0,
+                 stats = False, policy = None, evaluator = None, eval_batch = 1):
         self.game = copy.deepcopy(game)
         self.n_playouts = n_playouts
         self.player = player
         self.C = C
         self.root = Node(game.get_state(), None, None, player)
         self.epsilon = epsilon
+        self.compact = compact
+        self.scratch = None
+        self.workers = workers
+        self.worker_playouts = n_playouts if worker_playouts is None else worker_playouts
+        self.pool = None
+        if parallel not in ('root', 'tree'):
+            raise ValueError("parallel must be 'root' or 'tree'")
+        if workers > 1 and (time_limit is not None or max_nodes is not None):
+            raise ValueError("time_limit and max_nodes need a serial search")
+        self.parallel = parallel
+        self.virtual_loss = virtual_loss
+        self.batch_playouts = batch_playouts
+        self.batcher = BatchRollout(self.game.ROW_COUNT, self.game.COLUMN_COUNT) if batch_playouts else None
+        self.reuse_tree = reuse_tree
+        self.last_action = None
+        self.reused_visits = 0
+        if transpositions and (compact or workers > 1):
+            raise ValueError("transpositions need a serial search with stored boards")
+        if transpositions and reuse_tree: #freeing the old tree would unlink nodes the kept subtree shares
+            raise ValueError("transpositions cannot be combined with reuse_tree")
+        self.tt = TranspositionTable(transpositions) if transpositions else None
+        self.path = []
+        self.nodes_created = 0
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.iterations = 0
+        self.vectorized = vectorized
+        self.book = book
+        self.symmetry = symmetry
+        self.solver_threshold = solver_threshold
+        self.solver = Solver(self.game) if solver_threshold else None
+        self.policy = makePolicy(policy)
+        if evaluator is not None and (transpositions or workers > 1):
+            raise ValueError("an evaluator needs a serial search without transpositions")
+        self.evaluator = evaluator
+        self.eval_batch = max(1, eval_batch)
+        self.evaluations = 0
+        self.stats = None
+        if stats:
+            self.stats = SearchStats()
+            self.stats.instrument(self)
     
     
-    def bestMove(self, state, player):
-        self.root = Node(state, None, None, player)
+    def bestMove(self, state, player, time_limit=None, max_nodes=None):
+        time_limit, max_nodes = self.budget(time_limit, max_nodes)
+        start = time.perf_counter()
+        move = self.bookMove(state, player)
+        if move is None:
+            move = self.solverMove(state, player)
+        if move is not None:
+            return move
+        if self.workers > 1 and self.parallel == 'tree':
+            return self.treeParallelMove(state, player)
+        if self.workers > 1:
+            return self.rootParallelMove(state, player)
+        root = self.promoteSubtree(state, player) if self.reuse_tree else None
+        self.last_action = None
+        state = copy.deepcopy(state) #expand plays its moves on the root board and takes them back
+        if self.compact:
+            self.scratch = state
+        if root is None:
+            root = Node(state, None, None, player)
+            self.setRootStatus(root)
+            self.reused_visits = 0
+        else:
+            root.state = state
+            self.reused_visits = root.visits
+        self.root = root
+        self.nodes_created = 0
+        if self.tt is not None:
+            self.tt.clear()
+            root.key = self.game.hashState(state)
         node = self.root
-        if(self.game.checkTerminalState(self.root.state, self.root.player)[0]):
+        if self.root.terminal and not self.root.children: #the game is over, a proven root has children
             return 42
         for i in range(3):
             self.expand(node)
-            if self.game.checkTerminalState(node.state, node.player)[0]:
+            if node.terminal:
                 break
             node = random.choice(node.children)
             
-        for i in range(self.n_playouts):
-            self.MCTSIteration(node)
+        if time_limit is not None:
+            time_limit = max(0.0, time_limit - (time.perf_counter() - start))
+        if self.evaluator is not None:
+            self.evaluatorSearch(time_limit, max_nodes)
+            best = max(self.root.children, key=lambda child: child.visits)
+        elif time_limit is None and max_nodes is None:
+            for i in range(self.n_playouts):
+                self.MCTSIteration(node)
+            self.iterations = self.n_playouts
+            best = self.bestChild(self.root)
+        else:
+            self.searchWithBudget(node, time_limit, max_nodes)
+            best = max(self.root.children, key=lambda child: child.visits)
+        if self.root.terminal:
+            best = self.provenChild(self.root)
 
-        if self.bestChild(self.root).action in self.game.validMoves(self.root.state):
-            return self.bestChild(self.root).action
+        action = self.childAction(self.root, best)
+        if action in self.game.validMoves(self.root.state):
+            self.last_action = action
+            return action
         else:
             return 
 
+    #the budget of one move, arguments override the constructor's; the solver stops at the same
+    #deadline and bestMove takes the time spent before the search (solver included) off the search
+    def budget(self, time_limit, max_nodes):
+        time_limit = self.time_limit if time_limit is None else time_limit
+        max_nodes = self.max_nodes if max_nodes is None else max_nodes
+        if self.workers > 1 and (time_limit is not None or max_nodes is not None):
+            raise ValueError("time_limit and max_nodes need a serial search")
+        if self.solver is not None:
+            self.solver.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        return time_limit, max_nodes
+
+    #anytime search: iterate until the deadline or the node budget is used up, or until the most
+    #visited root child leads by more visits than the iterations that are left can give the runner-up.
+    #near the end of the game the tree can run out of nodes to create before max_nodes, so the search
+    #also stops once no leaf is left to expand, and never runs more than MAX_ITERATIONS_PER_NODE*max_nodes
+    #iterations
+    def searchWithBudget(self, node, time_limit, max_nodes):
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        max_iterations = None if max_nodes is None else MAX_ITERATIONS_PER_NODE*max(max_nodes, 1)
+        self.iterations = 0
+        created = self.nodes_created
+        while True:
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            if max_nodes is not None and (self.nodes_created >= max_nodes or self.iterations >= max_iterations):
+                break
+            self.MCTSIteration(node)
+            self.iterations += 1
+            if self.iterations % 32 == 0:
+                if max_nodes is not None and self.nodes_created == created and self.exhausted():
+                    break
+                created = self.nodes_created
+                if self.decided(now - start, deadline, now, max_nodes):
+                    break
+
+    #leaf-batched search for the evaluator: n_playouts leaves, or as many as the budget allows when
+    #time_limit/max_nodes are set. the virtual loss on the pending paths steers the rest of the batch
+    #away from leaves that are already waiting for their value. a max_nodes search stops early like
+    #searchWithBudget when the tree cannot grow any more
+    def evaluatorSearch(self, time_limit, max_nodes):
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        budget = time_limit is not None or max_nodes is not None
+        max_iterations = None if max_nodes is None else MAX_ITERATIONS_PER_NODE*max(max_nodes, 1)
+        self.iterations = 0
+        self.evaluations = 0
+        created, checked = self.nodes_created, 0
+        while budget or self.iterations < self.n_playouts:
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            if max_nodes is not None and (self.nodes_created >= max_nodes or self.iterations >= max_iterations):
+                break
+            size = self.eval_batch if budget else min(self.eval_batch, self.n_playouts - self.iterations)
+            leaves = [self.selectLeaf() for i in range(size)]
+            rewards = self.evaluateLeaves(leaves)
+            for node, reward in zip(leaves, rewards):
+                if node.terminal:
+                    node.visits += 1
+                self.finishLeafReward(node, reward)
+            self.iterations += size
+            if max_nodes is not None and self.iterations - checked >= 32:
+                if self.nodes_created == created and self.exhausted():
+                    break
+                created, checked = self.nodes_created, self.iterations
+            if budget and self.decided(now - start, deadline, now, max_nodes):
+                break
+
+    #terminal leaves are scored by the rules, the others in one evaluator call
+    def evaluateLeaves(self, leaves):
+        rewards = [self.calcReward(node.winner, self.root.player) if node.terminal else None for node in leaves]
+        pending = [i for i, node in enumerate(leaves) if not node.terminal]
+        if pending:
+            boards = np.stack([self.game.toArray(self.leafBoard(leaves[i])) for i in pending]).astype(np.int8)
+            to_move = np.array([leaves[i].player for i in pending], dtype=np.int8)[:, None, None]
+            boards = np.where(boards == to_move, 1, np.where(boards == 0, 0, -1)).astype(np.int8)
+            values = self.evaluator(boards)
+            self.evaluations += len(pending)
+            for i, value in zip(pending, values):
+                if leaves[i].player != self.root.player:
+                    value = -value
+                rewards[i] = self.valueReward(float(value))
+        return rewards
+
+    #a value in [-1, 1] read as the odds of a win (value > 0) or a loss (value < 0) against a draw,
+    #on the same scale as calcReward
+    def valueReward(self, value):
+        win, loss = max(value, 0.0), max(-value, 0.0)
+        return win*self.calcReward(self.root.player, self.root.player) + loss*self.calcReward(
+            self.game.nextPlayer(self.root.player), self.root.player) + (1 - win - loss)*self.calcReward(0, self.root.player)
+
+    def decided(self, elapsed, deadline, now, max_nodes):
+        if self.rootWinner() != -1:
+            return True
+        remaining = math.inf
+        if deadline is not None and elapsed > 0:
+            remaining = (deadline - now)*self.iterations/elapsed
+        if max_nodes is not None and self.nodes_created > 0:
+            remaining = min(remaining, (max_nodes - self.nodes_created)*self.iterations/self.nodes_created)
+        visits = sorted(self.rootVisits(), reverse=True)
+        return len(visits) < 2 or visits[0] - visits[1] > remaining
+
+    def rootVisits(self):
+        return [child.visits for child in self.root.children]
+
+    #True when every leaf that selection can reach is terminal, so no iteration can create a node any
+    #more (selection stops at proven nodes)
+    def exhausted(self):
+        stack = [self.root]
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if id(node) in seen or node.terminal:
+                continue
+            seen.add(id(node))
+            if not node.children:
+                return False
+            stack.extend(node.children)
+        return True
+
+    #(max depth, expanded nodes, children of the expanded nodes) of the current tree
+    def treeShape(self):
+        max_depth, expanded, children = 0, 0, 0
+        stack = [(self.root, 0)]
+        seen = set()
+        while stack:
+            node, depth = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            max_depth = max(max_depth, depth)
+            if node.children:
+                expanded += 1
+                children += len(node.children)
+                stack.extend((child, depth + 1) for child in node.children)
+        return max_depth, expanded, children
+
+    def bookMove(self, state, player):
+        if self.book is None:
+            return None
+        move = self.book.lookup(self.game.positionKey(state, player))
+        if move is None or move not in self.game.validMoves(state):
+            return None
+        self.root = Node(state, None, None, player)
+        self.last_action = None
+        self.iterations = 0
+        return move
+
+    def solverMove(self, state, player):
+        if self.solver is None or self.game.countMoves(state) + self.solver_threshold < self.game.ROW_COUNT*self.game.COLUMN_COUNT:
+            return None
+        score, move = self.solver.solve(state, player)
+        if move is None:
+            return None
+        self.root = Node(state, None, None, player)
+        self.last_action = None
+        self.iterations = 0
+        return move
+
+    #proven winner of board with player to move, None when there are too many empty cells to solve
+    def solvedWinner(self, board, player, moves):
+        if self.solver is None or moves + self.solver_threshold < self.game.ROW_COUNT*self.game.COLUMN_COUNT:
+            return None
+        return self.solver.winner(board, player)
+
+    #MCTS-Solver: node is proven once a child wins for its player to move or all of its children are
+    #proven, and then its parent may be proven in turn. only with solver_threshold; with transpositions
+    #only the parent that created a node is told
+    def prove(self, node):
+        while self.solver is not None and node is not None and not node.terminal and node.children:
+            winner = self.provenWinner(node.player, [child.winner if child.terminal else -1 for child in node.children])
+            if winner is None:
+                break
+            node.terminal, node.winner = True, winner
+            node = node.parent
+
+    #the result for player to move given the winners of the children (-1 where not proven), None if open
+    def provenWinner(self, player, winners):
+        if player in winners:
+            return player
+        if -1 in winners:
+            return None
+        return 0 if 0 in winners else self.game.nextPlayer(player)
+
+    #the child that keeps the proven result of node: a win if there is one, else a draw
+    def provenChild(self, node):
+        for winner in (node.player, 0):
+            for child in node.children:
+                if child.terminal and child.winner == winner:
+                    return child
+        return max(node.children, key=lambda child: child.visits)
+
+    def rootWinner(self):
+        return self.root.winner if self.root.terminal else -1
+
+    #mean score of the root child playing action, i.e. the search's value of the next state
+    def rootValue(self, action):
+        for child in self.root.children:
+            if child.visits and self.childAction(self.root, child) == action:
+                return child.score/child.visits
+        return None
+
+    #a shared node keeps the action of the parent that created it, other parents find
+    #their move from the column where the boards differ
+    def childAction(self, node, child):
+        if child.parent is node:
+            return child.action
+        changed = self.game.toArray(child.state) != self.game.toArray(node.state)
+        return int(np.flatnonzero(changed.any(axis=0))[0])
+
+    #after our move and the opponent's reply the position should be a grandchild of the
+    #old root, detach it as the new root and drop the rest of the tree
+    def promoteSubtree(self, state, player):
+        if self.last_action is None:
+            return None
+        target = self.game.toArray(state)
+        for child in self.root.children:
+            if self.childAction(self.root, child) != self.last_action:
+                continue
+            for grandchild in child.children:
+                if grandchild.player != player:
+                    continue
+                if self.compact:
+                    board, path = self.loadBoard(grandchild)
+                    same = np.array_equal(self.game.toArray(board), target)
+                    self.unloadBoard(path)
+                else:
+                    same = np.array_equal(self.game.toArray(grandchild.state), target)
+                if same:
+                    grandchild.parent = None
+                    self.freeTree(self.root, grandchild)
+                    return grandchild
+        return None
+
+    #break the parent/children cycles so the discarded nodes are freed right away
+    def freeTree(self, node, keep):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for child in node.children:
+                if child is not keep:
+                    stack.append(child)
+            node.children = []
+            node.parent = None
+
+
+    #the root is the only node without a last move, so it gets one full board scan
+    def setRootStatus(self, node):
+        node.moves = self.game.countMoves(node.state)
+        for player in (node.player, self.game.nextPlayer(node.player)):
+            node.terminal, node.winner = self.game.checkTerminalState(node.state, player)
+            if node.terminal:
+                break
+
+    #the pool is created on first use and kept for the following moves
+    def getPool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def rootParallelMove(self, state, player):
+        self.root = Node(state, None, None, player)
+        self.setRootStatus(self.root)
+        if self.root.terminal:
+            return 42
+        self.iterations = self.workers*self.worker_playouts
+        jobs = [(self.game, state, player, self.worker_playouts, self.C, self.epsilon, self.compact, self.policy,
+                 random.getrandbits(32)) for i in range(self.workers)]
+        merged = {}
+        for results in self.getPool().map(rootParallelWorker, jobs):
+            for action, visits, score in results:
+                totals = merged.setdefault(action, [0, 0])
+                totals[0] += visits
+                totals[1] += score
+        for action in sorted(merged):
+            child = Node(None, self.root, action, self.game.nextPlayer(player))
+            child.visits, child.score = merged[action]
+            self.root.children.append(child)
+            self.root.visits += child.visits
+        best = max(self.root.children, key=lambda child: child.visits) #a high mean over a few visits is mostly noise
+        return best.action
+
+    #only this process touches the tree, so visits and scores stay consistent without locks;
+    #the GIL would serialise playouts in threads, so they are farmed out to the process pool
+    def treeParallelMove(self, state, player):
+        state = copy.deepcopy(state)
+        if self.compact:
+            self.scratch = state
+        self.root = Node(state, None, None, player)
+        self.setRootStatus(self.root)
+        if self.root.terminal:
+            return 42
+        self.expand(self.root)
+        pool = self.getPool()
+        pending = {}
+        started = 0
+        finished = 0
+        while finished < self.n_playouts:
+            while started < self.n_playouts and len(pending) < 2*self.workers:
+                node = self.selectLeaf()
+                started += 1
+                if node.terminal:
+                    self.finishLeaf(node, node.winner)
+                    finished += 1
+                    continue
+                job = (self.game, self.leafBoard(node), node.player, node.moves, self.policy, random.getrandbits(32))
+                pending[pool.submit(playoutWorker, job)] = node
+            if pending:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finishLeaf(pending.pop(future), future.result())
+                    finished += 1
+        self.iterations = finished
+        if self.root.terminal:
+            return self.provenChild(self.root).action
+        return self.bestChild(self.root).action
+
+    #same descent as MCTSIteration, plus a virtual loss on the path so other pending
+    #playouts are steered elsewhere
+    def selectLeaf(self):
+        node = self.select(self.root)
+        if node.visits != 0:
+            self.expand(node)
+            node = self.select(node)
+        parent = node
+        while parent is not None:
+            parent.score -= self.virtual_loss
+            parent = parent.parent
+        return node
+
+    def finishLeaf(self, node, winner):
+        self.finishLeafReward(node, self.calcReward(winner, self.root.player))
+
+    def finishLeafReward(self, node, reward):
+        parent = node
+        while parent is not None:
+            parent.score += self.virtual_loss
+            parent = parent.parent
+        self.backpropagate(node, reward)
+
+    #a standalone board for node, compact nodes are rebuilt on the scratch board
+    def leafBoard(self, node):
+        if node.state is not None:
+            return node.state
+        board, path = self.loadBoard(node)
+        board = copy.deepcopy(board)
+        self.unloadBoard(path)
+        return board
 
     def MCTSIteration(self, node):
+        self.path = [self.root]
         node = self.select(self.root)
         if node.visits == 0:
-            winner = self.playout(node.state)
-            reward = self.calcReward(winner, node.player)
+            reward = self.evaluateLeaf(node)
         else:
             self.expand(node)
             node = self.select(node)
-            winner = self.playout(node.state) #add rewards
-            reward = self.calcReward(winner, node.player)
-        self.backpropagate(node, reward) #change to rewards
+            reward = self.evaluateLeaf(node) #add rewards
+        if node.terminal:
+            node.visits += 1 #terminal leaves are never expanded, so select never counts them
+        if self.tt is not None:
+            self.backpropagatePath(self.path, reward)
+        else:
+            self.backpropagate(node, reward) #change to rewards
+
+    #rewards are always scored for the player to move at the root
+    def evaluateLeaf(self, node):
+        if not self.batch_playouts or node.terminal:
+            return self.calcReward(self.simulate(node), self.root.player)
+        board = self.game.toArray(self.leafBoard(node))
+        winners, counts = np.unique(self.batcher.playout(board, node.player, self.batch_playouts), return_counts=True)
+        return sum(self.calcReward(winner, self.root.player)*int(count) for winner, count in zip(winners, counts))/self.batch_playouts
+
+    def simulate(self, node):
+        if node.terminal:
+            return node.winner
+        if not self.compact:
+            return self.playout(node.state, node.moves, node.player)
+        board, path = self.loadBoard(node)
+        winner = self.playoutInPlace(board, node.moves, node.player)
+        self.unloadBoard(path)
+        return winner
+
+    #compact mode: replay the actions from the root onto the scratch board
+    def loadBoard(self, node):
+        path = []
+        while node.state is None:
+            path.append(node)
+            node = node.parent
+        for child in reversed(path):
+            self.game.dropPiece(node.state, child.action, child.parent.player)
+        return node.state, path
+
+    def unloadBoard(self, path):
+        for child in path:
+            self.game.unplayMove(self.scratch, child.action)
 
+    #proven nodes are scored like the end of the game, only the root is searched below its proof
     def select(self, node):
-        while node.children:
+        while node.children and (not node.terminal or node is self.root):
             node.visits += 1
             if self.epsilon < random.random():
-                return random.choice(node.children)
+                node = random.choice(node.children)
             else:             
-                return self.bestChild(node)
+                node = self.bestChild(node)
+            if self.tt is not None:
+                self.path.append(node)
         return node
     
+    #every move is played on the parent board and taken back, children keep a copy unless compact
     def expand(self, node):
-        if not self.game.checkTerminalState(node.state, node.player)[0]:
-            legal_moves = self.game.validMoves(node.state)
+        if not node.terminal and not node.children:
+            if self.compact:
+                board, path = self.loadBoard(node)
+            else:
+                board = node.state
+            legal_moves = self.expandMoves(board)
             for move in legal_moves:
-                new_board = copy.deepcopy(node.state)
-                self.game.playMoveWithCopy(new_board, move, node.player)
-                new_node = Node(new_board, node, move, self.game.nextPlayer(node.player))
-                new_node.visits += 1
+                row = self.game.dropPiece(board, move, node.player)
+                new_node = None
+                if self.tt is not None:
+                    key = self.game.updateHash(node.key, row, move, node.player)
+                    new_node = self.tt.get(key)
+                if new_node is None:
+                    new_node = Node(None if self.compact else copy.deepcopy(board), node, move, self.game.nextPlayer(node.player))
+                    new_node.visits += 1
+                    new_node.moves = node.moves + 1
+                    new_node.terminal, new_node.winner = self.game.checkLastMove(board, row, move, node.player, new_node.moves)
+                    if not new_node.terminal:
+                        winner = self.solvedWinner(board, new_node.player, new_node.moves)
+                        if winner is not None:
+                            new_node.terminal, new_node.winner = True, winner
+                    self.nodes_created += 1
+                    if self.tt is not None:
+                        new_node.key = key
+                        self.tt.put(key, new_node)
+                self.game.unplayMove(board, move)
                 node.children.append(new_node)
+            if self.compact:
+                self.unloadBoard(path)
+            self.prove(node)
 
-    def playout(self, state):
+    #on a symmetric board column c and its mirror lead to mirrored subtrees with the same
+    #statistics, so only the left half (and the middle column) is searched. any other board is
+    #expanded in full, and a search rarely meets a symmetric board past the first few moves
+    def expandMoves(self, board):
+        legal_moves = self.game.validMoves(board)
+        if self.symmetry and self.game.isSymmetric(board):
+            return [move for move in legal_moves if move <= self.game.mirrorAction(move)]
+        return legal_moves
+
+    #moves is the number of pieces already on the board, pass it to skip the initial full scan;
+    #player is the one to move on state (the agent's own player if not given)
+    def playout(self, state, moves=None, player=None):
         rollout_board = copy.deepcopy(state)
-        player = self.player
-        terminal_state, winner = self.game.checkTerminalState(rollout_board, player) #check player
+        player = self.player if player is None else player
+        if moves is None:
+            moves = self.game.countMoves(rollout_board)
+            terminal_state, winner = self.game.checkTerminalState(rollout_board, player) #check player
+        else:
+            terminal_state, winner = False, -1
         while terminal_state == False:
 
             legal_moves = self.game.validMoves(rollout_board)
-            self.game.playMoveWithCopy(rollout_board, random.choice(legal_moves), player)
+            if self.policy is None:
+                col = random.choice(legal_moves)
+            else:
+                col = self.policy.chooseMove(self.game, rollout_board, player, legal_moves)
+            row = self.game.dropPiece(rollout_board, col, player)
+            moves += 1
+            terminal_state, winner = self.game.checkLastMove(rollout_board, row, col, player, moves)
             player = self.game.nextPlayer(player)
-            terminal_state, winner = self.game.checkTerminalState(rollout_board, player)
+        return winner
+
+    #same as playout but plays on board itself and takes the moves back afterwards
+    def playoutInPlace(self, board, moves, player=None):
+        played = []
+        player = self.player if player is None else player
+        terminal_state, winner = False, -1
+        while terminal_state == False:
+            if self.policy is None:
+                col = random.choice(self.game.validMoves(board))
+            else:
+                col = self.policy.chooseMove(self.game, board, player, self.game.validMoves(board))
+            row = self.game.dropPiece(board, col, player)
+            played.append(col)
+            moves += 1
+            terminal_state, winner = self.game.checkLastMove(board, row, col, player, moves)
+            player = self.game.nextPlayer(player)
+        for col in reversed(played):
+            self.game.unplayMove(board, col)
         return winner
     
     def calcReward(self, winner, player):
@@ -137,15 +954,23 @@ class MCTS():
             #node.visits += 1
             node = node.parent
 
+    #shared nodes have several parents, so follow the path the iteration actually took
+    def backpropagatePath(self, path, score):
+        for node in path:
+            node.score += score
+
     def bestChild(self, node):
         best_score = -10000000000
         best_nodes = []
         if node.children:
+            log_visits = math.log(node.visits) if node.visits > 0 else 0.0 #once per node, not per child
+            if self.vectorized:
+                return self.bestChildVectorized(node, log_visits)
             for child in node.children:
                 if child.visits == 0:
                     score = 0
                 else:
-                    score = (child.score/child.visits) + self.C * np.sqrt(np.log(node.visits)/child.visits)
+                    score = (child.score/child.visits) + self.C * math.sqrt(log_visits/child.visits)
                 
                 if score > best_score:
                     best_score = score
@@ -156,11 +981,492 @@ class MCTS():
         else:
             return node
 
+    #UCB1 of every child at once, unvisited children score 0 like in the loop above
+    def bestChildVectorized(self, node, log_visits):
+        count = len(node.children)
+        visits = np.fromiter((child.visits for child in node.children), dtype=float, count=count)
+        scores = np.fromiter((child.score for child in node.children), dtype=float, count=count)
+        seen = np.maximum(visits, 1)
+        ucb = np.where(visits == 0, 0.0, scores/seen + self.C*np.sqrt(log_visits/seen))
+        return node.children[random.choice(np.flatnonzero(ucb == ucb.max()))]
+
+################################################
+#array-backed tree: every node is a row in preallocated NumPy columns and the children of a
+#node are stored next to each other, so they are the slice first_child[i]:first_child[i]+n_children[i]
+class NodeStore():
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.score = np.zeros(capacity, dtype=np.float64)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.n_children = np.zeros(capacity, dtype=np.int16)
+        self.action = np.full(capacity, -1, dtype=np.int16)
+        self.player = np.zeros(capacity, dtype=np.int8)
+        self.winner = np.full(capacity, -1, dtype=np.int8) #-1 while the game is still running
+        self.moves = np.zeros(capacity, dtype=np.int16)
+        self.size = 0
+
+    def clear(self):
+        for column in (self.visits, self.score, self.n_children, self.player, self.moves):
+            column[:self.size] = 0
+        for column in (self.parent, self.first_child, self.action, self.winner):
+            column[:self.size] = -1
+        self.size = 0
+
+    def add(self, parent, action, player, moves):
+        if self.size == self.capacity:
+            return -1
+        index = self.size
+        self.size += 1
+        self.parent[index] = parent
+        self.action[index] = action
+        self.player[index] = player
+        self.moves[index] = moves
+        return index
+
+    def nbytes(self):
+        return sum(column.nbytes for column in (self.visits, self.score, self.parent, self.first_child,
+                                                self.n_children, self.action, self.player, self.winner, self.moves))
+
+
+#MCTS over a NodeStore, boards are rebuilt on one scratch board by replaying the actions
+#from the root; once the store is full the leaves just stop being expanded
+class ArrayMCTS(MCTS):
+    def __init__(self, game, n_playouts, player, C = 10*np.sqrt(2), epsilon = 0.25, capacity = 1000000,
+                 time_limit = None, max_nodes = None, book = None, symmetry = False, solver_threshold = 0, stats = False,
+                 policy = None):
+        MCTS.__init__(self, game, n_playouts, player, C, epsilon, time_limit=time_limit, max_nodes=max_nodes, book=book,
+                      symmetry=symmetry, solver_threshold=solver_threshold, stats=stats, policy=policy)
+        self.store = NodeStore(capacity)
+
+    def bestMove(self, state, player, time_limit=None, max_nodes=None):
+        store = self.store
+        store.clear()
+        time_limit, max_nodes = self.budget(time_limit, max_nodes)
+        start = time.perf_counter()
+        move = self.bookMove(state, player)
+        if move is None:
+            move = self.solverMove(state, player)
+        if move is not None:
+            return move
+        self.scratch = copy.deepcopy(state)
+        status = Node(self.scratch, None, None, player)
+        self.setRootStatus(status)
+        if status.terminal:
+            return 42
+        store.add(-1, -1, player, status.moves)
+        self.nodes_created = 0
+        node = 0
+        for i in range(3):
+            self.expand(node)
+            if store.winner[node] != -1 or store.n_children[node] == 0:
+                break
+            node = store.first_child[node] + random.randrange(store.n_children[node])
+
+        if time_limit is not None:
+            time_limit = max(0.0, time_limit - (time.perf_counter() - start))
+        if time_limit is None and max_nodes is None:
+            for i in range(self.n_playouts):
+                self.MCTSIteration(0)
+            self.iterations = self.n_playouts
+            best = self.bestChild(0)
+        else:
+            self.searchWithBudget(0, time_limit, max_nodes)
+            first = store.first_child[0]
+            best = first + int(np.argmax(store.visits[first:first + store.n_children[0]]))
+        if store.winner[0] != -1:
+            best = self.provenChild(0)
+        action = int(store.action[best])
+        if action in self.game.validMoves(self.scratch):
+            return action
+        else:
+            return 
+
+    def rootVisits(self):
+        first = self.store.first_child[0]
+        return self.store.visits[first:first + self.store.n_children[0]].tolist()
+
+    #a full store cannot grow either, even with leaves left: it has no room for another set of children.
+    #the tree is walked one level at a time without going below proven nodes
+    def exhausted(self):
+        store = self.store
+        if store.size + self.game.COLUMN_COUNT > store.capacity:
+            return True
+        parents = store.parent[:store.size]
+        level = np.zeros(1, dtype=parents.dtype)
+        while len(level):
+            level = level[store.winner[level] == -1]
+            if (store.n_children[level] == 0).any():
+                return False
+            level = np.flatnonzero(np.isin(parents, level))
+        return True
+
+    #children always come after their parent, so the depths are found one level at a time
+    def treeShape(self):
+        store = self.store
+        if store.size == 0:
+            return 0, 0, 0
+        parents = store.parent[:store.size]
+        counts = store.n_children[:store.size]
+        level = np.zeros(1, dtype=parents.dtype)
+        max_depth = 0
+        while True:
+            level = np.flatnonzero(np.isin(parents, level))
+            if len(level) == 0:
+                break
+            max_depth += 1
+        return max_depth, int(np.count_nonzero(counts)), int(counts.sum())
+
+    def prove(self, node):
+        store = self.store
+        while self.solver is not None and node >= 0 and store.winner[node] == -1 and store.n_children[node] > 0:
+            first = store.first_child[node]
+            winners = store.winner[first:first + store.n_children[node]].tolist()
+            winner = self.provenWinner(int(store.player[node]), winners)
+            if winner is None:
+                break
+            store.winner[node] = winner
+            node = store.parent[node]
+
+    def provenChild(self, node):
+        store = self.store
+        first = store.first_child[node]
+        children = range(first, first + store.n_children[node])
+        for winner in (store.player[node], 0):
+            for child in children:
+                if store.winner[child] == winner:
+                    return child
+        return max(children, key=lambda child: store.visits[child])
+
+    def rootWinner(self):
+        return int(self.store.winner[0])
+
+    def rootValue(self, action):
+        store = self.store
+        first = store.first_child[0]
+        for child in range(first, first + store.n_children[0]):
+            if store.action[child] == action and store.visits[child]:
+                return float(store.score[child]/store.visits[child])
+        return None
+
+    def MCTSIteration(self, node):
+        store = self.store
+        self.path = [0]
+        node = self.select(0)
+        if store.visits[node] == 0:
+            reward = self.evaluateLeaf(node)
+        else:
+            self.expand(node)
+            node = self.select(node)
+            reward = self.evaluateLeaf(node)
+        if store.winner[node] != -1:
+            store.visits[node] += 1
+        self.backpropagate(self.path, reward)
+
+    def select(self, node):
+        store = self.store
+        while store.n_children[node] > 0 and (store.winner[node] == -1 or node == 0):
+            store.visits[node] += 1
+            if self.epsilon < random.random():
+                node = store.first_child[node] + random.randrange(store.n_children[node])
+            else:
+                node = self.bestChild(node)
+            self.path.append(node)
+        return node
+
+    #UCB1 for all children in one array expression, ties broken at random
+    def bestChild(self, node):
+        store = self.store
+        count = store.n_children[node]
+        if count == 0:
+            return node
+        first = store.first_child[node]
+        visits = store.visits[first:first + count]
+        seen = np.maximum(visits, 1)
+        log_visits = math.log(store.visits[node]) if store.visits[node] > 0 else 0.0
+        ucb = np.where(visits == 0, 0.0, store.score[first:first + count]/seen + self.C*np.sqrt(log_visits/seen))
+        return first + random.choice(np.flatnonzero(ucb == ucb.max()))
+
+    #plays the actions from the root to node on the scratch board, returns them for unloadBoard
+    def loadBoard(self, node):
+        store = self.store
+        path = []
+        while node > 0:
+            path.append(node)
+            node = store.parent[node]
+        for index in reversed(path):
+            self.game.dropPiece(self.scratch, int(store.action[index]), int(store.player[store.parent[index]]))
+        return self.scratch, path
+
+    def unloadBoard(self, path):
+        for index in path:
+            self.game.unplayMove(self.scratch, int(self.store.action[index]))
+
+    def expand(self, node):
+        store = self.store
+        if store.winner[node] != -1 or store.n_children[node] > 0:
+            return
+        board, path = self.loadBoard(node)
+        player = int(store.player[node])
+        legal_moves = self.expandMoves(board)
+        if store.size + len(legal_moves) <= store.capacity:
+            store.first_child[node] = store.size
+            store.n_children[node] = len(legal_moves)
+            moves = int(store.moves[node]) + 1
+            for move in legal_moves:
+                row = self.game.dropPiece(board, move, player)
+                child = store.add(node, move, self.game.nextPlayer(player), moves)
+                store.visits[child] = 1
+                terminal_state, winner = self.game.checkLastMove(board, row, move, player, moves)
+                if not terminal_state:
+                    winner = self.solvedWinner(board, self.game.nextPlayer(player), moves)
+                    terminal_state = winner is not None
+                if terminal_state:
+                    store.winner[child] = winner
+                self.game.unplayMove(board, move)
+            self.nodes_created += len(legal_moves)
+        self.unloadBoard(path)
+        self.prove(node)
+
+    def evaluateLeaf(self, node):
+        store = self.store
+        if store.winner[node] != -1:
+            winner = int(store.winner[node])
+        else:
+            board, path = self.loadBoard(node)
+            winner = self.playoutInPlace(board, int(store.moves[node]), int(store.player[node]))
+            self.unloadBoard(path)
+        return self.calcReward(winner, int(store.player[0]))
+
+    def backpropagate(self, path, score):
+        self.store.score[path] += score
+
+
+#runs in a worker process, returns (action, visits, score) for every root child
+def rootParallelWorker(job):
+    game, state, player, n_playouts, C, epsilon, compact, policy, seed = job
+    random.seed(seed)
+    agent = MCTS(game, n_playouts, player, C, epsilon, compact, policy=policy)
+    agent.bestMove(state, player)
+    return [(child.action, child.visits, child.score) for child in agent.root.children]
+
+#runs in a worker process, returns the winner of one random playout
+def playoutWorker(job):
+    game, state, player, moves, policy, seed = job
+    random.seed(seed)
+    agent = MCTS(game, 0, player, policy=policy)
+    return agent.playout(state, moves)
+
+################################################
+#K random games at once on a (K, ROW_COUNT, COLUMN_COUNT) array, every game in the batch
+#has played the same number of moves so only the set of still running games changes
+class BatchRollout():
+    def __init__(self, ROW_COUNT, COLUMN_COUNT):
+        self.ROW_COUNT = ROW_COUNT
+        self.COLUMN_COUNT = COLUMN_COUNT
+
+    #returns the winner of every game: 1, 2 or 0 for a draw
+    def playout(self, state, player, K):
+        state = np.asarray(state)
+        boards = np.repeat(state[None].astype(np.int8), K, axis=0)
+        heights = np.repeat(np.count_nonzero(state, axis=0)[None], K, axis=0)
+        winners = np.full(K, -1)
+        moves = int(np.count_nonzero(state))
+        for p in (player, 3 - player):
+            winners[(winners == -1) & self.checkWins(boards, p)] = p
+        if moves == self.ROW_COUNT*self.COLUMN_COUNT:
+            winners[winners == -1] = 0
+        active = np.flatnonzero(winners == -1)
+        while active.size:
+            legal = heights[active] < self.ROW_COUNT
+            cols = np.where(legal, np.random.random(legal.shape), -1).argmax(axis=1)
+            rows = heights[active, cols]
+            boards[active, rows, cols] = player
+            heights[active, cols] += 1
+            moves += 1
+            won = self.checkWins(boards[active], player)
+            winners[active[won]] = player
+            active = active[~won]
+            if moves == self.ROW_COUNT*self.COLUMN_COUNT:
+                winners[active] = 0
+                break
+            player = 3 - player
+        return winners
+
+    #shifted-slice comparison of every window, one bool per board
+    def checkWins(self, boards, player):
+        b = boards == player
+        horizontal = b[:, :, :-3] & b[:, :, 1:-2] & b[:, :, 2:-1] & b[:, :, 3:]
+        vertical = b[:, :-3, :] & b[:, 1:-2, :] & b[:, 2:-1, :] & b[:, 3:, :]
+        diagonal = b[:, :-3, :-3] & b[:, 1:-2, 1:-2] & b[:, 2:-1, 2:-1] & b[:, 3:, 3:]
+        anti_diagonal = b[:, 3:, :-3] & b[:, 2:-1, 1:-2] & b[:, 1:-2, 2:-1] & b[:, :-3, 3:]
+        return (horizontal.any(axis=(1, 2)) | vertical.any(axis=(1, 2))
+                | diagonal.any(axis=(1, 2)) | anti_diagonal.any(axis=(1, 2)))
+
+################################################
+#leaf evaluators for MCTS(evaluator=...): called with a (B, ROW_COUNT, COLUMN_COUNT) int8 array of
+#boards seen by the player to move (1 own piece, -1 opponent piece, 0 empty) and return B values in
+#[-1, 1], the expected result for that player. any callable with this signature works, e.g. a
+#NumPy MLP or values read out of a Q-table
+
+#every line of four cells scored at once: a line that only holds pieces of one side counts
+#weights[pieces] for that side, the difference is squashed with tanh
+class WindowEvaluator():
+    def __init__(self, ROW_COUNT, COLUMN_COUNT, weights=(0.0, 1.0, 4.0, 16.0, 0.0), scale=32.0):
+        self.ROW_COUNT = ROW_COUNT
+        self.COLUMN_COUNT = COLUMN_COUNT
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.scale = scale
+        cells = np.arange(ROW_COUNT*COLUMN_COUNT).reshape(ROW_COUNT, COLUMN_COUNT)
+        windows = []
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for r in range(ROW_COUNT):
+                for c in range(COLUMN_COUNT):
+                    if 0 <= r + 3*dr < ROW_COUNT and 0 <= c + 3*dc < COLUMN_COUNT:
+                        windows.append([cells[r + k*dr, c + k*dc] for k in range(4)])
+        self.windows = np.array(windows, dtype=np.intp).reshape(-1, 4)
+
+    def __call__(self, boards):
+        lines = boards.reshape(len(boards), -1)[:, self.windows]
+        own = (lines == 1).sum(axis=2)
+        other = (lines == -1).sum(axis=2)
+        score = (np.where(other == 0, self.weights[own], 0) - np.where(own == 0, self.weights[other], 0)).sum(axis=1)
+        return np.tanh(score/self.scale)
+
+################################################
+#raised inside Solver.negamax once the deadline has passed, solve turns it into an unsolved result
+class SolverTimeout(Exception):
+    pass
+
+
+#negamax with alpha-beta, center-first move ordering, a transposition table and iterative deepening.
+#scores are for the player to move: ROW_COUNT*COLUMN_COUNT + 1 - (pieces on the board after the
+#winning move) for a win, so faster wins score higher, the negative of that for a loss and 0 for a
+#draw. a search that stops at a depth limit scores the cut-off positions 0 as well, a non-zero
+#result is still proven but 0 only means a draw once the search reached the end of the game.
+#the search runs on a bitboard copy of the position whatever the backend of game.
+#deadline (a time.perf_counter() value) makes solve give up, see SolverTimeout
+class Solver():
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, game, max_entries=1000000):
+        self.game = game if isinstance(game, BitboardConnect4) else BitboardConnect4(game.ROW_COUNT, game.COLUMN_COUNT)
+        self.source = game
+        self.cells = game.ROW_COUNT*game.COLUMN_COUNT
+        middle = (game.COLUMN_COUNT - 1)/2
+        self.order = sorted(range(game.COLUMN_COUNT), key=lambda col: abs(col - middle))
+        self.max_entries = max_entries
+        self.table = {} #position key -> (depth, flag, score, best move)
+        self.nodes = 0
+        self.deadline = None
+
+    #(score, best move) for player to move on state, max_depth limits the plies searched;
+    #(None, None) if the deadline passed first
+    def solve(self, state, player, max_depth=None):
+        if len(self.table) > self.max_entries:
+            self.table.clear()
+        board = self.game.fromArray(self.source.toArray(state))
+        moves = self.game.countMoves(board)
+        key = self.game.positionKey(board, player)
+        empty = self.cells - moves
+        if max_depth is not None:
+            empty = min(empty, max_depth)
+        score, move = 0, None
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return None, None
+        try:
+            for depth in range(1, empty + 1):
+                score = self.negamax(board, player, key, moves, depth, -math.inf, math.inf)
+                move = self.table[key][3]
+                if score != 0:
+                    break
+        except SolverTimeout:
+            return None, None
+        return score, move
+
+    #the proven winner of state with player to move (0 for a draw), None if it was not solved
+    def winner(self, state, player, max_depth=None):
+        score, move = self.solve(state, player, max_depth)
+        if score is None:
+            return None
+        elif score > 0:
+            return player
+        elif score < 0:
+            return self.game.nextPlayer(player)
+        elif max_depth is None or self.source.countMoves(state) + max_depth >= self.cells:
+            return 0
+        return None
+
+    def negamax(self, board, player, key, moves, depth, alpha, beta):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % 1024 == 0 and time.perf_counter() > self.deadline:
+            raise SolverTimeout()
+        if depth == 0:
+            return 0
+        alpha_start = alpha
+        best_move = None
+        entry = self.table.get(key)
+        if entry is not None:
+            entry_depth, flag, score, best_move = entry
+            if entry_depth >= depth:
+                if flag == Solver.EXACT:
+                    return score
+                elif flag == Solver.LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+        valid = self.game.validMoves(board)
+        ordered = [col for col in self.order if col in valid]
+        if best_move in valid:
+            ordered.remove(best_move)
+            ordered.insert(0, best_move)
+        opponent = self.game.nextPlayer(player)
+        turn = self.game.zobrist_turn[player] ^ self.game.zobrist_turn[opponent]
+        best = -math.inf
+        for col in ordered:
+            row = self.game.dropPiece(board, col, player)
+            terminal_state, winner = self.game.checkLastMove(board, row, col, player, moves + 1)
+            if terminal_state:
+                score = self.cells - moves if winner == player else 0
+            else:
+                child_key = key ^ self.game.zobrist[row][col][player] ^ turn
+                score = -self.negamax(board, opponent, child_key, moves + 1, depth - 1, -beta, -alpha)
+            self.game.unplayMove(board, col)
+            if score > best:
+                best, best_move = score, col
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        if best <= alpha_start:
+            flag = Solver.UPPER
+        elif best >= beta:
+            flag = Solver.LOWER
+        else:
+            flag = Solver.EXACT
+        self.table[key] = (depth, flag, best, best_move)
+        return best
+
+
+#plays the solver's move, perfect play on boards small enough to solve from the current position
+class PerfectPlayer():
+    def __init__(self, game, player, max_entries=1000000):
+        self.game = game
+        self.player = player
+        self.solver = Solver(game, max_entries)
+
+    def bestMove(self, state, player):
+        return self.solver.solve(state, player)[1]
 
 ################################################
 #Qlearning for connect 4
+#symmetric=True stores a board and its mirror image in one row, keyed by the smaller of the two
+#hashes, actions are mirrored on the way in and out of the table
+#dense is a DenseQTable, Q and N then live in its arrays instead of the dicts below
 class QLearning():
-    def __init__(self, game, player, alpha=0.5, gamma=0.9, epsilon=0.1):
+    def __init__(self, game, player, alpha=0.5, gamma=0.9, epsilon=0.1, symmetric=False, dense=None):
         # self.game = copy.deepcopy(game)
         self.game = game
         self.player = player
@@ -169,13 +1475,43 @@ class QLearning():
         self.epsilon = epsilon
         self.Q = defaultdict(lambda: defaultdict(lambda: 0))
         self.N = defaultdict(lambda: defaultdict(lambda: 0))
+        self.symmetric = symmetric
+        self.dense = dense
+        #when set to a list every update is also recorded as (key, action, reward), see qLearningWorker
+        self.experiences = None
+
+    #table key of state and whether its actions are stored mirrored
+    def tableKey(self, state):
+        if self.symmetric:
+            return self.game.canonicalKey(state)
+        return self.game.stateKey(state), False
 
     def bestMove(self, state):
-        state = hashable(state)
+        key, mirrored = self.tableKey(state)
+        if self.dense is not None:
+            return self.denseBestMove(state, self.dense.index(key), mirrored)
+        q_row = self.Q[key]
         if random.random() < self.epsilon:
-            return random.choice(self.game.validMoves(state.unwrap()))
+            return random.choice(self.game.validMoves(state))
+        elif mirrored:
+            return max(self.game.validMoves(state), key = lambda x: q_row[self.game.mirrorAction(x)])
         else:
-            return max(self.game.validMoves(state.unwrap()), key = lambda x: self.Q[state.wrap()][x])
+            return max(self.game.validMoves(state), key = lambda x: q_row[x])
+
+    #argmax over the valid columns of one table row, the first column wins ties like max() above
+    def denseBestMove(self, state, row, mirrored):
+        moves = self.game.validMoves(state)
+        if random.random() < self.epsilon:
+            return random.choice(moves)
+        columns = np.array(moves)
+        values = self.dense.q[row, self.game.mirrorAction(columns) if mirrored else columns]
+        return moves[int(np.argmax(values))]
+
+    #number of states with a stored row
+    def states(self):
+        if self.dense is not None:
+            return self.dense.visited()
+        return len(self.Q)
     
     def QLearningRun(self, state):
         action = self.bestMove(state)
@@ -194,13 +1530,257 @@ class QLearning():
             return -50
 
     def updateQ(self, state, action, reward):
-        state = hashable(state)
-        self.N[state.wrap()][action] += 1
-        self.Q[state.wrap()][action] += (self.alpha/self.N[state.wrap()][action]) * (reward + self.gamma * max(self.Q[state.wrap()].values()) - self.Q[state.wrap()][action])
-    
+        key, mirrored = self.tableKey(state)
+        if mirrored:
+            action = self.game.mirrorAction(action)
+        self.applyUpdate(key, action, reward)
+
+    #update of one table row, key and action are already in table space (canonical if symmetric)
+    def applyUpdate(self, key, action, reward):
+        if self.experiences is not None:
+            self.experiences.append((key, action, reward))
+        if self.dense is not None:
+            row = self.dense.index(key)
+            q_row = self.dense.q[row]
+            count = int(self.dense.n[row, action]) + 1
+            self.dense.n[row, action] = count
+            #actions that were never updated count as 0 in the max
+            value = float(q_row[action])
+            q_row[action] = value + (self.alpha/count) * (reward + self.gamma * float(q_row.max()) - value)
+            return
+        q_row = self.Q[key]
+        n_row = self.N[key]
+        n_row[action] += 1
+        q_row[action] += (self.alpha/n_row[action]) * (reward + self.gamma * max(q_row.values()) - q_row[action])
+
+    #one record per state sorted by the 64-bit key, q is NaN for actions that were never stored
+    def saveTable(self, path):
+        if self.dense is not None:
+            np.save(path, self.dense.entries())
+            return
+        keys = set(self.Q) | set(self.N)
+        if isinstance(self.Q, MappedQTable):
+            keys |= set(int(key) for key in self.Q.keys_on_disk)
+        width = self.game.COLUMN_COUNT if self.game is not None else 1
+        rows = {}
+        for key in keys:
+            q_row, n_row = self.Q[key], self.N[key]
+            rows[key & MASK64] = (q_row, n_row)
+            width = max([width] + [action + 1 for action in q_row] + [action + 1 for action in n_row])
+        entries = np.zeros(len(rows), dtype=qTableDtype(width))
+        entries['q'] = np.nan
+        for i, key in enumerate(sorted(rows)):
+            q_row, n_row = rows[key]
+            entries['key'][i] = key
+            for action, value in q_row.items():
+                entries['q'][i, action] = value
+            for action, count in n_row.items():
+                entries['n'][i, action] = count
+        np.save(path, entries)
+
+    #the file is memory-mapped, rows are only read when a state is looked up
+    def loadTable(self, path):
+        entries = np.load(path, mmap_mode='r')
+        if self.dense is not None:
+            self.dense.load(entries)
+            return
+        self.Q = MappedQTable(entries['key'], entries['q'])
+        self.N = MappedQTable(entries['key'], entries['n'])
+
+
+MASK64 = 2**64 - 1
+
+def qTableDtype(width):
+    return np.dtype([('key', '<u8'), ('q', '<f4', (width,)), ('n', '<u4', (width,))])
+
+
+#dict of state key -> {action: value} backed by one column of a saved table, a state's row is
+#found by binary search on first use and then kept in memory so updates work as before
+class MappedQTable(dict):
+    def __init__(self, keys_on_disk, values_on_disk):
+        dict.__init__(self)
+        self.keys_on_disk = keys_on_disk
+        self.values_on_disk = values_on_disk
+
+    def __missing__(self, key):
+        row = defaultdict(lambda: 0)
+        index = int(np.searchsorted(self.keys_on_disk, np.uint64(key & MASK64)))
+        if index < len(self.keys_on_disk) and int(self.keys_on_disk[index]) == key & MASK64:
+            values = self.values_on_disk[index]
+            if values.dtype.kind == 'f':
+                present = np.flatnonzero(~np.isnan(values))
+                for action in present:
+                    row[int(action)] = float(values[action])
+            else:
+                present = np.flatnonzero(values)
+                for action in present:
+                    row[int(action)] = int(values[action])
+        self[key] = row
+        return row
+
+
+#Q and N of every reachable board of a small game in two (n_states, COLUMN_COUNT) arrays, the
+#row of a board is the rank of its 64-bit key among the sorted keys of all reachable boards
+class DenseQTable():
+    def __init__(self, keys, COLUMN_COUNT):
+        self.keys = keys
+        self.q = np.zeros((len(keys), COLUMN_COUNT), dtype=np.float32)
+        self.n = np.zeros((len(keys), COLUMN_COUNT), dtype=np.uint32)
+        self.last = (None, -1) #bestMove and updateQ look up the same state one after the other
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, key):
+        if self.last[0] == key:
+            return self.last[1]
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index < len(self.keys) and int(self.keys[index]) == key:
+            self.last = (key, index)
+            return index
+        raise KeyError(key)
+
+    def visited(self):
+        return int(np.count_nonzero(self.n.any(axis=1)))
+
+    def nbytes(self):
+        return self.keys.nbytes + self.q.nbytes + self.n.nbytes
+
+    #the visited rows in the qTableDtype records of QLearning.saveTable
+    def entries(self):
+        rows = np.flatnonzero(self.n.any(axis=1))
+        entries = np.zeros(len(rows), dtype=qTableDtype(self.q.shape[1]))
+        entries['key'] = self.keys[rows]
+        entries['q'] = np.where(self.n[rows] > 0, self.q[rows], np.nan)
+        entries['n'] = self.n[rows]
+        return entries
+
+    def load(self, entries):
+        rows = np.searchsorted(self.keys, entries['key'])
+        if np.any(rows >= len(self.keys)) or np.any(self.keys[np.minimum(rows, len(self.keys) - 1)] != entries['key']):
+            raise ValueError("the table has states that are not in this state space")
+        width = self.q.shape[1]
+        self.q[rows] = np.nan_to_num(entries['q'][:, :width])
+        self.n[rows] = entries['n'][:, :width]
+
+    #keys of every board reachable with player 1 moving first, only the boards where player is to
+    #move if it is given, and one key per mirrored pair (the canonicalKey one) if symmetric
+    @staticmethod
+    def reachableKeys(ROW_COUNT, COLUMN_COUNT, player=None, symmetric=False):
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        board = game.state
+        seen = {(0, 0): 1} #(key, mirrored key) -> player to move
+
+        def visit(key, mirror_key, moves, to_move):
+            for col in game.validMoves(board):
+                row = game.dropPiece(board, col, to_move)
+                child = (key ^ game.zobrist[row][col][to_move], mirror_key ^ game.zobrist_mirror[row][col][to_move])
+                if child not in seen:
+                    seen[child] = game.nextPlayer(to_move)
+                    if not game.checkLastMove(board, row, col, to_move, moves + 1)[0]:
+                        visit(child[0], child[1], moves + 1, game.nextPlayer(to_move))
+                game.unplayMove(board, col)
+
+        visit(0, 0, 0, 1)
+        keys = set()
+        for (key, mirror_key), to_move in seen.items():
+            if player is None or to_move == player:
+                keys.add(min(key, mirror_key) if symmetric else key)
+        return np.array(sorted(keys), dtype=np.uint64)
+
+    @staticmethod
+    def build(ROW_COUNT, COLUMN_COUNT, player=None, symmetric=False):
+        return DenseQTable(DenseQTable.reachableKeys(ROW_COUNT, COLUMN_COUNT, player, symmetric), COLUMN_COUNT)
+
+
+#one training game like the loops commented out in main: player 1 (random, or MCTS with
+#opponent_playouts playouts) moves first and algo (player 2) learns from every one of its moves,
+#returns the winner
+def qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT, opponent_playouts=0):
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    algo.game = game
+    opponent = MCTS(game, opponent_playouts, 1) if opponent_playouts else RandomPlayer(game, 1)
+    player = 1
+    while True:
+        if player == 1:
+            game.playMove(opponent.bestMove(game.state, player), player)
+        else:
+            game.playMove(algo.QLearningRun(game.state), player)
+        terminal_state, winner = game.checkTerminalState(game.state, player)
+        if terminal_state:
+            return winner
+        player = game.nextPlayer(player)
+
+
+#runs in a worker process: plays episodes against its own copy of the table (updated as it
+#learns) and returns the stream of updates it made plus the winners
+def qLearningWorker(job):
+    ROW_COUNT, COLUMN_COUNT, episodes, opponent_playouts, q_table, n_table, options, seed = job
+    random.seed(seed)
+    algo = QLearning(None, 2, **options)
+    for key, row in q_table.items():
+        algo.Q[key].update(row)
+    for key, row in n_table.items():
+        algo.N[key].update(row)
+    algo.experiences = []
+    winners = [qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT, opponent_playouts) for i in range(episodes)]
+    return algo.experiences, winners
+
+
+#trains algo with workers processes: every round each worker gets a snapshot of the table and
+#batch_episodes games, then their update streams are replayed into algo.Q in job order so a run
+#is repeatable for a given seed and worker count; episodes_per_sec caps the training rate.
+#rows of a table opened with loadTable that were never touched stay on disk and are not sent
+def trainQLearning(algo, ROW_COUNT, COLUMN_COUNT, episodes, workers=None, batch_episodes=50, opponent_playouts=0,
+                   episodes_per_sec=None, seed=0):
+    workers = workers or os.cpu_count() or 1
+    options = {'alpha': algo.alpha, 'gamma': algo.gamma, 'epsilon': algo.epsilon, 'symmetric': algo.symmetric,
+               'dense': algo.dense}
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    trained = 0
+    experiences = 0
+    rounds = 0
+    wins = defaultdict(lambda: 0)
+    start = time.perf_counter()
+    try:
+        while trained < episodes:
+            q_table = {key: dict(row) for key, row in algo.Q.items()}
+            n_table = {key: dict(row) for key, row in algo.N.items()}
+            if pool is None and algo.dense is not None: #a worker in this process would learn into algo.dense itself
+                options['dense'] = copy.deepcopy(algo.dense)
+            jobs = []
+            for i in range(workers):
+                count = min(batch_episodes, episodes - trained - len(jobs)*batch_episodes)
+                if count <= 0:
+                    break
+                jobs.append((ROW_COUNT, COLUMN_COUNT, count, opponent_playouts, q_table, n_table, options,
+                             seed*1000003 + rounds*workers + i))
+            results = pool.map(qLearningWorker, jobs) if pool is not None else map(qLearningWorker, jobs)
+            for stream, winners in results:
+                for key, action, reward in stream:
+                    algo.applyUpdate(key, action, reward)
+                experiences += len(stream)
+                for winner in winners:
+                    wins[winner] += 1
+            trained += sum(job[2] for job in jobs)
+            rounds += 1
+            if episodes_per_sec:
+                ahead = trained/episodes_per_sec - (time.perf_counter() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    seconds = time.perf_counter() - start
+    return {'episodes': trained, 'experiences': experiences, 'rounds': rounds, 'seconds': seconds,
+            'episodes_per_sec': trained/seconds, 'experiences_per_sec': experiences/seconds,
+            'states': algo.states(), 'wins': dict(wins)}
 
     
 ################################################
+#zobrist tables by (ROW_COUNT, COLUMN_COUNT), see Connect4.initZobrist
+ZOBRIST_TABLES = {}
+
 class Connect4():
     def __init__(self, ROW_COUNT, COLUMN_COUNT):
         self.state = np.zeros((ROW_COUNT,COLUMN_COUNT), dtype=int)  # change back to zeros
@@ -208,6 +1788,73 @@ class Connect4():
         self.COLUMN_COUNT = self.state.shape[1]
         self.player = 1
         self.actions = self.validMoves(self.state)
+        self.initZobrist()
+        #zobrist key of self.state and of its mirror image, playMove keeps them up to date
+        self.key = 0
+        self.mirror_key = 0
+        self.key_moves = 0
+
+
+    #random 64-bit keys per (row, column, player), seeded from the board size so that
+    #every process and every run agree on the hashes; built once per board size and shared,
+    #training loops create a new game every episode
+    def initZobrist(self):
+        size = (self.ROW_COUNT, self.COLUMN_COUNT)
+        if size not in ZOBRIST_TABLES:
+            ZOBRIST_TABLES[size] = self.buildZobrist()
+        (self.zobrist_array, self.zobrist, self.zobrist_flat, self.zobrist_offsets, self.zobrist_mirror,
+         self.zobrist_mirror_flat, self.zobrist_turn) = ZOBRIST_TABLES[size]
+
+    def buildZobrist(self):
+        rng = np.random.RandomState(self.ROW_COUNT*1000 + self.COLUMN_COUNT)
+        table = rng.randint(0, 2**64, size=(self.ROW_COUNT, self.COLUMN_COUNT, 3), dtype=np.uint64)
+        table[:, :, 0] = 0
+        offsets = np.arange(self.ROW_COUNT*self.COLUMN_COUNT)*3
+        turn = rng.randint(0, 2**64, size=3, dtype=np.uint64)
+        turn[0] = 0
+        #the mirror tables give the key of (row, column) in the board mirrored around the middle column
+        return (table, table.tolist(), table.reshape(-1), offsets, table[:, ::-1].tolist(),
+                np.ascontiguousarray(table[:, ::-1]).reshape(-1), turn.tolist())
+
+    def hashState(self, state):
+        board = np.asarray(self.toArray(state)).ravel()
+        return int(np.bitwise_xor.reduce(self.zobrist_flat[self.zobrist_offsets + board]))
+
+    #64-bit key of any board, the game's own board uses the key kept by playMove unless it was
+    #changed some other way (the piece count no longer matches)
+    def stateKey(self, state):
+        if state is self.state and self.key_moves == self.countMoves(state):
+            return self.key
+        return self.hashState(state)
+
+    #key shared by a board and its mirror image: the smaller of the two hashes, plus whether
+    #that is the hash of the mirror image
+    def canonicalKey(self, state):
+        if state is self.state and self.key_moves == self.countMoves(state):
+            key, mirror_key = self.key, self.mirror_key
+        else:
+            board = np.asarray(self.toArray(state)).ravel()
+            index = self.zobrist_offsets + board
+            key = int(np.bitwise_xor.reduce(self.zobrist_flat[index]))
+            mirror_key = int(np.bitwise_xor.reduce(self.zobrist_mirror_flat[index]))
+        if mirror_key < key:
+            return mirror_key, True
+        return key, False
+
+    def mirrorAction(self, action):
+        return self.COLUMN_COUNT - 1 - action
+
+    def isSymmetric(self, state):
+        board = self.toArray(state)
+        return np.array_equal(board, board[:, ::-1])
+
+    #board hash plus the player to move
+    def positionKey(self, state, player):
+        return self.hashState(state) ^ self.zobrist_turn[player]
+
+    #hash after player dropped a piece at (row, col), xor again to take the move back
+    def updateHash(self, key, row, col, player):
+        return key ^ self.zobrist[row][col][player]
 
 
     def get_next_state(self, state, action, player):
@@ -219,6 +1866,9 @@ class Connect4():
         for r in range(self.ROW_COUNT):
             if self.state[r][col_no] == 0:
                 self.state[r][col_no] = player_no
+                self.key = self.updateHash(self.key, r, col_no, player_no)
+                self.mirror_key ^= self.zobrist_mirror[r][col_no][player_no]
+                self.key_moves += 1
                 break
         return self.state
 
@@ -276,6 +1926,76 @@ class Connect4():
             return True
         return False
 
+    #same as playMoveWithCopy but returns the row the piece landed in (-1 for a full column)
+    def dropPiece(self, state, col_no, player_no):
+        for r in range(self.ROW_COUNT):
+            if state[r, col_no] == 0:
+                state[r, col_no] = player_no
+                return r
+        return -1
+
+    #take back the top piece of a column, returns the row it was in (-1 for an empty column)
+    def unplayMove(self, state, col_no):
+        for r in range(self.ROW_COUNT - 1, -1, -1):
+            if state[r, col_no] != 0:
+                state[r, col_no] = 0
+                return r
+        return -1
+
+    def countMoves(self, state):
+        return int(np.count_nonzero(state))
+
+    #a move can only complete a line through the cell it filled, so walk the four lines through (row, col)
+    def checkWinAt(self, state, row, col, player):
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            count = 1
+            r, c = row + dr, col + dc
+            while 0 <= r < self.ROW_COUNT and 0 <= c < self.COLUMN_COUNT and state[r, c] == player:
+                count += 1
+                r, c = r + dr, c + dc
+            r, c = row - dr, col - dc
+            while 0 <= r < self.ROW_COUNT and 0 <= c < self.COLUMN_COUNT and state[r, c] == player:
+                count += 1
+                r, c = r - dr, c - dc
+            if count >= 4:
+                return True
+        return False
+
+    #terminal check after player dropped a piece at (row, col), moves counts the pieces now on the board
+    def checkLastMove(self, state, row, col, player, moves):
+        if self.checkWinAt(state, row, col, player):
+            return True, player
+        if moves == self.ROW_COUNT*self.COLUMN_COUNT:
+            return True, 0
+        return False, -1
+
+    #columns where a piece of player would win right away: the same walk as checkWinAt from the
+    #cell the piece would land in, on a list copy of the board since list indexing is much
+    #cheaper than indexing the array one cell at a time
+    def winningMoves(self, state, player):
+        board = state.tolist()
+        wins = []
+        for col in range(self.COLUMN_COUNT):
+            row = 0
+            while row < self.ROW_COUNT and board[row][col] != 0:
+                row += 1
+            if row == self.ROW_COUNT:
+                continue
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                count = 1
+                r, c = row + dr, col + dc
+                while 0 <= r < self.ROW_COUNT and 0 <= c < self.COLUMN_COUNT and board[r][c] == player:
+                    count += 1
+                    r, c = r + dr, c + dc
+                r, c = row - dr, col - dc
+                while 0 <= r < self.ROW_COUNT and 0 <= c < self.COLUMN_COUNT and board[r][c] == player:
+                    count += 1
+                    r, c = r - dr, c - dc
+                if count >= 4:
+                    wins.append(col)
+                    break
+        return wins
+
     #return all valid moves
     def validMoves(self, state):
         valid_moves = []
@@ -287,14 +2007,1447 @@ class Connect4():
     def get_state(self):
         return self.state
 
+    #numpy boards are already arrays, kept so callers can treat every backend the same
+    def toArray(self, state):
+        return state
+
+    def fromArray(self, array_state):
+        return np.array(array_state, dtype=int)
+
     def PrintGrid(self, state):
         print(np.flip(state, 0))
 
+################################################
+#Bitboard backend for Connect4
+#each player gets an integer mask, column c / row r lives at bit c*(ROW_COUNT+1) + r,
+#the extra bit on top of every column is always empty so shifts never wrap between columns
+class BitboardState():
+    __slots__ = ('rows', 'masks', 'heights', 'moves')
+
+    def __init__(self, ROW_COUNT, COLUMN_COUNT):
+        self.rows = ROW_COUNT
+        self.masks = [0, 0, 0] #index 0 unused, 1 and 2 are the players
+        self.heights = [0] * COLUMN_COUNT
+        self.moves = 0
+
+    def copy(self):
+        new_state = BitboardState.__new__(BitboardState)
+        new_state.rows = self.rows
+        new_state.masks = self.masks[:]
+        new_state.heights = self.heights[:]
+        new_state.moves = self.moves
+        return new_state
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __array__(self, dtype=None, copy=None):
+        grid = np.zeros((self.rows, len(self.heights)), dtype=int if dtype is None else dtype)
+        stride = self.rows + 1
+        for c in range(len(self.heights)):
+            for r in range(self.heights[c]):
+                bit = 1 << (c*stride + r)
+                if self.masks[1] & bit:
+                    grid[r][c] = 1
+                elif self.masks[2] & bit:
+                    grid[r][c] = 2
+        return grid
+
+
+class BitboardConnect4(Connect4):
+    def __init__(self, ROW_COUNT, COLUMN_COUNT):
+        self.ROW_COUNT = ROW_COUNT
+        self.COLUMN_COUNT = COLUMN_COUNT
+        self.stride = ROW_COUNT + 1
+        #shift amounts for vertical, horizontal and the two diagonals
+        self.directions = (1, self.stride, self.stride - 1, self.stride + 1)
+        self.state = BitboardState(ROW_COUNT, COLUMN_COUNT)
+        self.player = 1
+        self.actions = self.validMoves(self.state)
+        self.initZobrist()
+        self.key = 0
+        self.mirror_key = 0
+        self.key_moves = 0
+
+    def playMove(self, col_no, player_no):
+        row = self.dropPiece(self.state, col_no, player_no)
+        if row >= 0:
+            self.key = self.updateHash(self.key, row, col_no, player_no)
+            self.mirror_key ^= self.zobrist_mirror[row][col_no][player_no]
+            self.key_moves += 1
+        return self.state
+
+    def playMoveWithCopy(self, state, col_no, player_no):
+        height = state.heights[col_no]
+        if height < self.ROW_COUNT:
+            state.masks[player_no] |= 1 << (col_no*self.stride + height)
+            state.heights[col_no] = height + 1
+            state.moves += 1
+        return state
+
+    def isWin(self, mask):
+        for shift in self.directions:
+            pairs = mask & (mask >> shift)
+            if pairs & (pairs >> (2*shift)):
+                return True
+        return False
+
+    def checkTerminalState(self, state, player):
+        if self.isWin(state.masks[player]):
+            return True, player
+        if self.checkDraw(state):
+            return True, 0
+        return False, -1
+
+    def checkDraw(self, state):
+        return state.moves == self.ROW_COUNT*self.COLUMN_COUNT
+
+    def dropPiece(self, state, col_no, player_no):
+        height = state.heights[col_no]
+        if height >= self.ROW_COUNT:
+            return -1
+        state.masks[player_no] |= 1 << (col_no*self.stride + height)
+        state.heights[col_no] = height + 1
+        state.moves += 1
+        return height
+
+    def unplayMove(self, state, col_no):
+        height = state.heights[col_no]
+        if height == 0:
+            return -1
+        height -= 1
+        bit = ~(1 << (col_no*self.stride + height))
+        state.masks[1] &= bit
+        state.masks[2] &= bit
+        state.heights[col_no] = height
+        state.moves -= 1
+        return height
+
+    def countMoves(self, state):
+        return state.moves
+
+    #the shift test is already constant time, the cell is not needed
+    def checkWinAt(self, state, row, col, player):
+        return self.isWin(state.masks[player])
+
+    #empty cells that would complete four in a row for player, intersected with the cells a
+    #piece can be dropped into right now
+    def winningMoves(self, state, player):
+        mask = state.masks[player]
+        cells = 0
+        for shift in self.directions:
+            pair = (mask << shift) & (mask << 2*shift)
+            cells |= pair & (mask << 3*shift)
+            cells |= pair & (mask >> shift)
+            pair = (mask >> shift) & (mask >> 2*shift)
+            cells |= pair & (mask >> 3*shift)
+            cells |= pair & (mask << shift)
+        wins = []
+        for col in range(self.COLUMN_COUNT):
+            height = state.heights[col]
+            if height < self.ROW_COUNT and cells >> (col*self.stride + height) & 1:
+                wins.append(col)
+        return wins
+
+    def validMoves(self, state):
+        return [c for c in range(self.COLUMN_COUNT) if state.heights[c] < self.ROW_COUNT]
+
+    def toArray(self, state):
+        return np.asarray(state)
+
+    def fromArray(self, array_state):
+        array_state = np.asarray(array_state)
+        if array_state.shape != (self.ROW_COUNT, self.COLUMN_COUNT):
+            raise ValueError("board shape does not match the game")
+        state = BitboardState(self.ROW_COUNT, self.COLUMN_COUNT)
+        for c in range(self.COLUMN_COUNT):
+            for r in range(self.ROW_COUNT):
+                player = int(array_state[r][c])
+                if player == 0:
+                    break
+                state.masks[player] |= 1 << (c*self.stride + r)
+                state.heights[c] += 1
+                state.moves += 1
+        return state
+
+    def PrintGrid(self, state):
+        print(np.flip(self.toArray(state), 0))
+
+################################################
+#Opening book: the best move of every position up to some depth, found offline with long MCTS
+#searches and saved as a key-sorted .npy array that is memory-mapped and binary searched
+
+BOOK_DTYPE = np.dtype([('key', '<u8'), ('move', 'u1'), ('value', '<f4')])
+
+class OpeningBook():
+    def __init__(self, path):
+        self.entries = np.load(path, mmap_mode='r')
+        self.keys = self.entries['key']
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, key):
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index < len(self.keys) and int(self.keys[index]) == key:
+            return int(self.entries['move'][index])
+        return None
+
+    #every non-terminal position with fewer than depth moves played, player 1 moving first
+    @staticmethod
+    def positions(ROW_COUNT, COLUMN_COUNT, depth):
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        frontier = {game.positionKey(game.state, 1): (game.state.copy(), 1)}
+        found = {}
+        for ply in range(depth):
+            next_frontier = {}
+            for key, (state, player) in frontier.items():
+                if any(game.checkTerminalState(state, p)[0] for p in (1, 2)):
+                    continue
+                found[key] = (state, player)
+                for move in game.validMoves(state):
+                    child = game.playMoveWithCopy(state.copy(), move, player)
+                    next_player = game.nextPlayer(player)
+                    next_frontier.setdefault(game.positionKey(child, next_player), (child, next_player))
+            frontier = next_frontier
+        return found
+
+    @staticmethod
+    def generate(path, ROW_COUNT=6, COLUMN_COUNT=5, depth=4, n_playouts=20000, workers=None, seed=0):
+        positions = OpeningBook.positions(ROW_COUNT, COLUMN_COUNT, depth)
+        keys = sorted(positions)
+        jobs = [(ROW_COUNT, COLUMN_COUNT, positions[key][0], positions[key][1], n_playouts, seed*1000003 + i)
+                for i, key in enumerate(keys)]
+        entries = np.zeros(len(keys), dtype=BOOK_DTYPE)
+        entries['key'] = keys
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for i, (move, value) in enumerate(pool.map(bookWorker, jobs)):
+                entries['move'][i] = move
+                entries['value'][i] = value
+        np.save(path, entries)
+        return OpeningBook(path)
+
+
+#runs in a worker process, one long search for a book position
+def bookWorker(job):
+    ROW_COUNT, COLUMN_COUNT, state, player, n_playouts, seed = job
+    random.seed(seed)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    algo = MCTS(game, n_playouts, player)
+    move = algo.bestMove(state, player)
+    value = algo.rootValue(move)
+    return move, 0.0 if value is None else value
+
+################################################
+#Game driver
+
+MoveRecord = namedtuple('MoveRecord', ['player', 'agent', 'action', 'playouts', 'value', 'seconds'])
+GameRecord = namedtuple('GameRecord', ['winner', 'moves'])
+
+
+#QLearning.bestMove only takes the state
+def agentMove(agent, state, player):
+    if isinstance(agent, QLearning):
+        return agent.bestMove(state)
+    return agent.bestMove(state, player)
+
+
+#plays agent1 (player 1) against agent2 (player 2) on game with exactly one search per ply,
+#render(game, record) is called after every move
+def play_game(agent1, agent2, game, render=None):
+    agents = {1: agent1, 2: agent2}
+    moves = []
+    player = 1
+    while True:
+        agent = agents[player]
+        start = time.perf_counter()
+        action = agentMove(agent, game.state, player)
+        seconds = time.perf_counter() - start
+        if action not in game.validMoves(game.state):
+            raise ValueError(f"player {player} chose an invalid move {action}")
+        game.playMove(action, player)
+        if isinstance(agent, MCTS):
+            record = MoveRecord(player, type(agent).__name__, action, agent.iterations, agent.rootValue(action), seconds)
+        else:
+            record = MoveRecord(player, type(agent).__name__, action, None, None, seconds)
+        moves.append(record)
+        if render is not None:
+            render(game, record)
+        terminal_state, winner = game.checkTerminalState(game.state, player)
+        if terminal_state:
+            return GameRecord(winner, moves)
+        player = game.nextPlayer(player)
+        game.player = player
+
+
+def printMove(game, record):
+    print(f"Player {record.player} ({record.agent})")
+    print("Action selected :", record.action)
+    if record.playouts is not None:
+        print("Total playouts for next state:", record.playouts)
+    if record.value is not None:
+        print(f"Value of next state according to {record.agent} : {record.value:.4f}")
+    game.PrintGrid(game.state)
+
+################################################
+#Tournaments
+#an agent config is a dict such as {'agent': 'MCTS', 'n_playouts': 40, 'C': 1}, {'agent': 'RandomPlayer'}
+#or {'agent': 'QLearning'}, {'agent': 'PerfectPlayer'}; every key apart from 'agent' and 'name' goes to the constructor
+
+def makeAgent(config, game, player):
+    options = {key: value for key, value in config.items() if key not in ('agent', 'name')}
+    if config['agent'] == 'MCTS':
+        return MCTS(game, options.pop('n_playouts', 200), player, **options)
+    elif config['agent'] == 'RandomPlayer':
+        return RandomPlayer(game, player, **options)
+    elif config['agent'] == 'QLearning':
+        return QLearning(game, player, **options)
+    elif config['agent'] == 'PerfectPlayer':
+        return PerfectPlayer(game, player, **options)
+    raise ValueError("unknown agent " + str(config['agent']))
+
+
+def agentName(config):
+    if 'name' in config:
+        return config['name']
+    options = ",".join(f"{key}={config[key]}" for key in sorted(config) if key != 'agent')
+    return config['agent'] + ("(" + options + ")" if options else "")
+
+
+#runs in a worker process, config_a plays first in even games and second in odd ones
+def tournamentGame(job):
+    game_id, config_a, config_b, ROW_COUNT, COLUMN_COUNT, seed = job
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    player_a = 1 if game_id % 2 == 0 else 2
+    player_b = game.nextPlayer(player_a)
+    agents = {player_a: makeAgent(config_a, game, player_a), player_b: makeAgent(config_b, game, player_b)}
+    start = time.perf_counter()
+    result = play_game(agents[1], agents[2], game)
+    winner = result.winner
+    moves = len(result.moves)
+    for agent in agents.values():
+        if isinstance(agent, MCTS):
+            agent.close()
+    if winner == player_a:
+        result = 'a'
+    elif winner == player_b:
+        result = 'b'
+    else:
+        result = 'draw'
+    return {'game': game_id, 'a': agentName(config_a), 'b': agentName(config_b), 'a_player': player_a,
+            'winner': winner, 'result': result, 'moves': moves, 'seed': seed,
+            'seconds': round(time.perf_counter() - start, 4)}
+
+
+#finished games of this pairing, a crash can leave a half written last line which is skipped
+def readTournament(out_path, name_a, name_b):
+    records = {}
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('a') == name_a and record.get('b') == name_b:
+                    records[record['game']] = record
+    return records
+
+
+#95% Wilson score interval of k successes in n trials
+def wilsonInterval(k, n, z=1.96):
+    if n == 0:
+        return 0.0, 1.0
+    p = k/n
+    centre = (p + z*z/(2*n))/(1 + z*z/n)
+    half = z*math.sqrt(p*(1 - p)/n + z*z/(4*n*n))/(1 + z*z/n)
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def summarizeTournament(records):
+    n = len(records)
+    summary = {'games': n}
+    for result in ('a', 'b', 'draw'):
+        k = sum(1 for record in records if record['result'] == result)
+        summary[result] = {'count': k, 'rate': k/n if n else 0.0, 'ci95': wilsonInterval(k, n)}
+    return summary
+
+
+#plays games between two agent configs on a process pool, every finished game is appended to
+#out_path as a JSON line right away and games already in the file are not played again
+def runTournament(config_a, config_b, games, out_path, ROW_COUNT=6, COLUMN_COUNT=5, workers=None, seed=0):
+    name_a, name_b = agentName(config_a), agentName(config_b)
+    records = readTournament(out_path, name_a, name_b)
+    jobs = [(game_id, config_a, config_b, ROW_COUNT, COLUMN_COUNT, seed*1000003 + game_id)
+            for game_id in range(games) if game_id not in records]
+    if jobs:
+        if os.path.exists(out_path) and os.path.getsize(out_path) > 0:
+            with open(out_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                unterminated = f.read(1) != b'\n'
+        else:
+            unterminated = False
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, open(out_path, 'a') as out:
+            if unterminated:
+                out.write('\n')
+            futures = [pool.submit(tournamentGame, job) for job in jobs]
+            for future in as_completed(futures):
+                record = future.result()
+                records[record['game']] = record
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+    return summarizeTournament([records[game_id] for game_id in sorted(records) if game_id < games])
+
+
+def printTournament(name_a, name_b, summary):
+    print(name_a, "vs", name_b, "-", summary['games'], "games")
+    for result, label in (('a', name_a + " wins"), ('b', name_b + " wins"), ('draw', "draws")):
+        low, high = summary[result]['ci95']
+        print(f"  {label}: {summary[result]['count']} ({summary[result]['rate']:.2f}, 95% CI {low:.2f}-{high:.2f})")
+
+
+#the C sweep from the report: MCTS 200 against MCTS 40 for every C, one JSONL file per C
+def sweepC(Cs=(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10), games=20, out_dir='tournaments', workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    win_rates = []
+    for c in Cs:
+        config_a = {'agent': 'MCTS', 'n_playouts': 200, 'C': c}
+        config_b = {'agent': 'MCTS', 'n_playouts': 40, 'C': c}
+        summary = runTournament(config_a, config_b, games, os.path.join(out_dir, f"sweep_C{c}.jsonl"), workers=workers)
+        printTournament(agentName(config_a), agentName(config_b), summary)
+        win_rates.append(summary['a']['rate'])
+    return win_rates
+
+################################################
+#Game server
+#GameServer keeps many games in memory and plays them over HTTP/1.1 (JSON bodies, keep-alive):
+#  POST   /games            {"rows", "cols", "player", "agent"} - new game, player is the client's side
+#                           (1 by default, the server moves first for 2), agent is a makeAgent config
+#                           restricted to SERVER_AGENTS
+#  GET    /games/<id>       board, player to move and winner (null while the game is running)
+#  POST   /games/<id>/move  {"column", "time_limit"} - the client's move and the server's reply
+#  DELETE /games/<id>
+#searches run in a process pool so a slow search never blocks the event loop. time_limit (seconds,
+#0 < time_limit <= max_time) is the budget of the whole request: time spent waiting for a free worker is
+#taken off the search. at most max_pending searches are queued or running, a move that would need
+#another one is refused with 503 and Retry-After before it is applied, so the client can send it again.
+#a request with a bad Content-Length gets 400, one with a body over max_body bytes 413, and then the
+#connection is closed since the rest of the stream cannot be read
+
+#agent options a client may set: all of them keep a search inside the request's time_limit, which
+#replaces n_playouts. workers, budgets of their own, books and agents without a time limit are refused
+SERVER_AGENTS = {'MCTS': ('n_playouts', 'C', 'epsilon', 'compact', 'vectorized', 'symmetry', 'policy', 'batch_playouts',
+                          'solver_threshold'),
+                 'RandomPlayer': ('policy',)}
+MAX_SERVER_BATCH = 256 #playouts in one batch_playouts call, a search only checks its deadline between calls
+
+
+def checkServerAgent(config, ROW_COUNT, COLUMN_COUNT):
+    if not isinstance(config, dict) or config.get('agent') not in SERVER_AGENTS:
+        raise ValueError("agent must be one of " + ", ".join(SERVER_AGENTS))
+    for key, value in config.items():
+        if key in ('agent', 'name'):
+            continue
+        if key not in SERVER_AGENTS[config['agent']]:
+            raise ValueError(f"option {key} is not allowed")
+        if key == 'policy':
+            if value is not None and value not in ROLLOUT_POLICIES:
+                raise ValueError("policy must be one of " + ", ".join(ROLLOUT_POLICIES))
+        elif key in ('compact', 'vectorized', 'symmetry'):
+            if not isinstance(value, bool):
+                raise ValueError(f"{key} must be true or false")
+        elif key in ('C', 'epsilon'):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"{key} must be a number")
+        else:
+            limit = {'n_playouts': 10**6, 'batch_playouts': MAX_SERVER_BATCH, 'solver_threshold': ROW_COUNT*COLUMN_COUNT}[key]
+            if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= limit:
+                raise ValueError(f"{key} must be an integer from 0 to {limit}")
+
+
+#runs in a worker process, deadline is on the time.time() clock shared by all processes
+def serverSearch(job):
+    config, ROW_COUNT, COLUMN_COUNT, board, player, deadline, seed = job
+    random.seed(seed)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    board = np.array(board, dtype=int)
+    agent = makeAgent(config, game, player)
+    if isinstance(agent, MCTS):
+        return agent.bestMove(board, player, time_limit=max(0.01, deadline - time.time()))
+    return agentMove(agent, board, player)
+
+
+class GameSession():
+    def __init__(self, game_id, ROW_COUNT, COLUMN_COUNT, player, agent):
+        self.id = game_id
+        self.game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        self.player = player
+        self.agent = agent
+        self.to_move = 1
+        self.winner = None
+        self.moves = 0
+        self.history = []
+        self.search = None #the pending reply of the server, see GameServer.reply
+
+    def play(self, column, player):
+        if self.winner is not None:
+            raise ValueError("the game is over")
+        if player != self.to_move:
+            raise ValueError("it is not the turn of player " + str(player))
+        if column not in self.game.validMoves(self.game.state):
+            raise ValueError("invalid move " + str(column))
+        self.game.playMove(column, player)
+        self.moves += 1
+        self.history.append(column)
+        terminal_state, winner = self.game.checkTerminalState(self.game.state, player)
+        if terminal_state:
+            self.winner = winner
+        self.to_move = self.game.nextPlayer(player)
+
+    #replays the game without its last move
+    def undo(self):
+        history = self.history[:-1]
+        self.game = Connect4(self.game.ROW_COUNT, self.game.COLUMN_COUNT)
+        self.to_move, self.winner, self.moves, self.history = 1, None, 0, []
+        for column in history:
+            self.play(column, self.to_move)
+
+    def view(self):
+        return {'id': self.id, 'board': self.game.state.tolist(), 'player': self.player, 'to_move': self.to_move,
+                'winner': self.winner, 'moves': self.moves}
+
+
+class GameServer():
+    def __init__(self, workers=None, max_pending=None, max_time=2.0, default_time=0.25, grace=1.0, max_games=10000,
+                 agent=None, max_board=10, max_body=65536):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending or 2*self.workers
+        self.max_time = max_time
+        self.default_time = default_time
+        self.grace = grace
+        self.max_games = max_games
+        self.max_board = max_board #rows and columns, this also bounds the zobrist tables cached per board size
+        self.max_body = max_body
+        self.agent = agent or {'agent': 'MCTS', 'n_playouts': 200}
+        self.sessions = {}
+        self.next_id = 0
+        self.pending = 0
+        self.pool = None
+        self.server = None
+        self.connections = {} #writer -> task serving the connection
+        self.counts = defaultdict(lambda: 0) #responses by status
+
+    #port 0 picks a free port, the one in use is returned
+    async def start(self, host='127.0.0.1', port=8080):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, int) for i in range(self.workers)]) #start the workers now
+        self.server = await asyncio.start_server(self.handleConnection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            handlers = list(self.connections.values())
+            for writer in list(self.connections): #idle keep-alive connections, their handlers see the end of the stream
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+        if self.pool is not None: #queued searches are dropped, running ones are waited for off the event loop
+            pool, self.pool = self.pool, None
+            await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(cancel_futures=True))
+
+    async def handleConnection(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await readHttpMessage(reader, self.max_body)
+                except BadHttpMessage as error:
+                    await self.respond(writer, error.status, {'error': str(error)}, close=True)
+                    break
+                if request is None:
+                    break
+                start_line, headers, body = request
+                try:
+                    method, path, version = start_line.split(' ', 2)
+                    payload = json.loads(body) if body else {}
+                except ValueError:
+                    status, reply = 400, {'error': 'malformed request'}
+                else:
+                    if isinstance(payload, dict):
+                        status, reply = await self.route(method, path, payload)
+                    else: #the handlers read fields with payload.get
+                        status, reply = 400, {'error': 'the body must be a JSON object'}
+                await self.respond(writer, status, reply)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def respond(self, writer, status, reply, close=False):
+        self.counts[status] += 1
+        extra = 'Retry-After: 1\r\n' if status == 503 else ''
+        if close:
+            extra += 'Connection: close\r\n'
+        data = json.dumps(reply).encode()
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n{extra}\r\n".encode() + data)
+        await writer.drain()
+
+    async def route(self, method, path, payload):
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts == ['games'] and method == 'POST':
+            return await self.newGame(payload)
+        if len(parts) < 2 or parts[0] != 'games':
+            return 404, {'error': 'not found'}
+        session = self.sessions.get(parts[1])
+        if session is None:
+            return 404, {'error': 'no game ' + parts[1]}
+        if len(parts) == 2 and method == 'GET':
+            return 200, session.view()
+        if len(parts) == 2 and method == 'DELETE':
+            del self.sessions[session.id]
+            return 200, {'id': session.id}
+        if parts[2:] == ['move'] and method == 'POST':
+            return await self.move(session, payload)
+        return 405, {'error': 'method not allowed'}
+
+    async def newGame(self, payload):
+        if len(self.sessions) >= self.max_games:
+            return 503, {'error': 'too many games'}
+        try:
+            ROW_COUNT, COLUMN_COUNT = int(payload.get('rows', 6)), int(payload.get('cols', 5))
+            player = int(payload.get('player', 1))
+            time_limit = self.timeLimit(payload)
+            if player not in (1, 2):
+                raise ValueError("player must be 1 or 2")
+            if not 1 <= min(ROW_COUNT, COLUMN_COUNT) <= max(ROW_COUNT, COLUMN_COUNT) <= self.max_board or max(ROW_COUNT, COLUMN_COUNT) < 4:
+                raise ValueError(f"rows and cols must be from 1 to {self.max_board}, one of them at least 4")
+        except (TypeError, ValueError) as error:
+            return 400, {'error': str(error)}
+        agent = payload.get('agent', self.agent)
+        try:
+            if 'agent' in payload:
+                checkServerAgent(agent, ROW_COUNT, COLUMN_COUNT)
+            makeAgent(agent, Connect4(ROW_COUNT, COLUMN_COUNT), 1)
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            return 400, {'error': 'bad agent config: ' + str(error)}
+        if player == 2 and self.pending >= self.max_pending:
+            return 503, {'error': 'all workers are busy'}
+        session = GameSession(str(self.next_id), ROW_COUNT, COLUMN_COUNT, player, agent)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        if player == 2:
+            return await self.reply(session, time_limit)
+        return 200, session.view()
+
+    async def move(self, session, payload):
+        if session.search is not None:
+            return 409, {'error': 'the server is still thinking', 'game': session.view()}
+        try:
+            column = int(payload['column'])
+        except (KeyError, TypeError, ValueError):
+            return 400, {'error': 'column must be an integer'}
+        try:
+            time_limit = self.timeLimit(payload)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        if session.winner is None and self.pending >= self.max_pending:
+            return 503, {'error': 'all workers are busy'}
+        try:
+            session.play(column, session.player)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        if session.winner is not None:
+            return 200, session.view()
+        return await self.reply(session, time_limit)
+
+    def timeLimit(self, payload):
+        try:
+            time_limit = float(payload.get('time_limit', self.default_time))
+        except (TypeError, ValueError):
+            time_limit = math.nan
+        if not 0 < time_limit <= self.max_time: #also false for nan
+            raise ValueError(f"time_limit must be a number above 0 and at most {self.max_time}")
+        return time_limit
+
+    #the search keeps running when the request gives up with 504, its move is still played and shows
+    #up in GET /games/<id>
+    async def reply(self, session, time_limit):
+        loop = asyncio.get_running_loop()
+        job = (session.agent, session.game.ROW_COUNT, session.game.COLUMN_COUNT, session.game.state.tolist(),
+               session.to_move, time.time() + time_limit, random.getrandbits(32))
+        self.pending += 1
+        session.search = asyncio.ensure_future(self.finishSearch(session, loop.run_in_executor(self.pool, serverSearch, job)))
+        try:
+            action = await asyncio.wait_for(asyncio.shield(session.search), time_limit + self.grace)
+        except asyncio.TimeoutError:
+            return 504, {'error': 'search is late', 'game': session.view()}
+        if isinstance(action, Exception):
+            return 500, {'error': 'search failed: ' + str(action), 'game': session.view()}
+        return 200, session.view()
+
+    #returns the server's move, or the exception if the search failed or gave an illegal move. a failed
+    #search takes back the client's move so it can be sent again; a game whose opening move by the
+    #server failed is dropped
+    async def finishSearch(self, session, future):
+        try:
+            action = await future
+        except Exception as error:
+            action = error
+        finally:
+            self.pending -= 1
+            session.search = None
+        if self.sessions.get(session.id) is not session:
+            return action
+        if not isinstance(action, Exception):
+            try:
+                session.play(action, session.to_move)
+                return action
+            except ValueError as error:
+                action = error
+        if session.history:
+            session.undo()
+        else:
+            del self.sessions[session.id]
+        return action
+
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+#raised by readHttpMessage for a message whose body cannot be read, status is the answer to send
+class BadHttpMessage(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+#(start line, lowercase headers, body) of the next request or response, None at the end of the stream;
+#max_body (bytes) refuses larger bodies before reading them
+async def readHttpMessage(reader, max_body=None):
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not (length.isascii() and length.isdigit()):
+        raise BadHttpMessage(400, "Content-Length must be a non-negative integer")
+    if max_body is not None and int(length) > max_body:
+        raise BadHttpMessage(413, f"the body is larger than {max_body} bytes")
+    body = await reader.readexactly(int(length))
+    return start_line.decode('latin-1').strip(), headers, body
+
+
+def serveGames(host='127.0.0.1', port=8080, **options):
+    async def run():
+        server = GameServer(**options)
+        port_in_use = await server.start(host, port)
+        print(f"serving games on http://{host}:{port_in_use} with {server.workers} workers")
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+#client side of the load test, one keep-alive connection per game
+async def httpRequest(reader, writer, method, path, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    start_line, headers, body = await readHttpMessage(reader)
+    return int(start_line.split(' ')[1]), json.loads(body) if body else {}
+
+
+#polls the game until it is the client's turn again or the game is over
+async def waitForTurn(reader, writer, game_id, interval=0.01):
+    while True:
+        status, game = await httpRequest(reader, writer, 'GET', f"/games/{game_id}")
+        if status != 200:
+            raise RuntimeError(f"game {game_id} lost with {status}: {game}")
+        if game['to_move'] == game['player'] or game['winner'] is not None:
+            return game
+        await asyncio.sleep(interval)
+
+
+#plays one game with random moves; 503 answers are retried after a short back-off. the latency of
+#a move runs from its first attempt until the server's reply is in the game, for a 504 that is
+#when polling finds it there
+async def loadTestGame(host, port, seed, time_limit, latencies, counts, ROW_COUNT, COLUMN_COUNT):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        status, game = await httpRequest(reader, writer, 'POST', '/games', {'rows': ROW_COUNT, 'cols': COLUMN_COUNT})
+        counts[status] += 1
+        while game['winner'] is None:
+            board = game['board']
+            column = rng.choice([c for c in range(COLUMN_COUNT) if board[ROW_COUNT - 1][c] == 0])
+            start = time.perf_counter()
+            while True:
+                status, reply = await httpRequest(reader, writer, 'POST', f"/games/{game['id']}/move",
+                                                  {'column': column, 'time_limit': time_limit})
+                counts[status] += 1
+                if status != 503:
+                    break
+                await asyncio.sleep(0.05 + 0.1*rng.random())
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                game = reply
+            elif status == 504:
+                moves = game['moves']
+                game = await waitForTurn(reader, writer, game['id'])
+                if game['moves'] > moves + 1: #otherwise the search failed and the move was taken back
+                    latencies.append(time.perf_counter() - start)
+            elif status in (409, 500): #the move was not played, wait for the turn and pick again
+                game = await waitForTurn(reader, writer, game['id'])
+            else:
+                raise RuntimeError(f"move refused with {status}: {reply}")
+        await httpRequest(reader, writer, 'DELETE', f"/games/{game['id']}")
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q*len(values))) - 1)] if values else float('nan')
+
+
+#N games at once against a server at host:port, or against one started here when port is None
+def runLoadTest(games=20, time_limit=0.1, host='127.0.0.1', port=None, ROW_COUNT=6, COLUMN_COUNT=5, seed=0, **options):
+    async def run():
+        server = None
+        target = port
+        if target is None:
+            server = GameServer(**options)
+            target = await server.start(host, 0)
+        latencies, counts = [], defaultdict(lambda: 0)
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[loadTestGame(host, target, seed*1000003 + i, time_limit, latencies, counts,
+                                                ROW_COUNT, COLUMN_COUNT) for i in range(games)])
+        finally:
+            if server is not None:
+                await server.close()
+        return latencies, dict(counts), time.perf_counter() - start
+
+    latencies, counts, seconds = asyncio.run(run())
+    print(f"{games} concurrent games, {time_limit}s per search, {len(latencies)} moves in {seconds:.1f}s")
+    print(f"move latency p50 {1000*percentile(latencies, 0.5):.1f} ms  p99 {1000*percentile(latencies, 0.99):.1f} ms")
+    print("responses by status:", counts)
+    return {'moves': len(latencies), 'seconds': seconds, 'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99), 'counts': counts}
+
+################################################
+#Benchmarks
+
+#total playouts per second of root-parallel MCTS for an increasing number of workers
+def benchmarkRootParallel(ROW_COUNT=6, COLUMN_COUNT=5, n_playouts=400, moves=3, worker_counts=None):
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1]*2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1]*2)
+    print("Root parallel MCTS,", ROW_COUNT, "x", COLUMN_COUNT, "board,", n_playouts, "playouts per worker")
+    print("workers  playouts/sec  speedup")
+    base_rate = None
+    for workers in worker_counts:
+        random.seed(0)
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        algo = MCTS(game, n_playouts, 1, workers=workers)
+        if workers > 1:
+            algo.bestMove(game.state, 1) #start the pool outside the timing
+        start = time.perf_counter()
+        for i in range(moves):
+            algo.bestMove(game.state, 1)
+        elapsed = time.perf_counter() - start
+        algo.close()
+        rate = workers*n_playouts*moves/elapsed
+        if base_rate is None:
+            base_rate = rate
+        print(f"{workers:7d}  {rate:12.1f}  {rate/base_rate:7.2f}")
+
+
+def measurePlayoutRate(algo, game, moves=2):
+    start = time.perf_counter()
+    for i in range(moves):
+        algo.bestMove(game.state, 1)
+    return algo.n_playouts*moves/(time.perf_counter() - start)
+
+
+#tree-parallel against the serial MCTSIteration loop with the same wall-clock time per move
+def benchmarkTreeParallel(ROW_COUNT=6, COLUMN_COUNT=5, seconds_per_move=0.5, games=10, workers=None):
+    if workers is None:
+        workers = max(2, os.cpu_count() or 1)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    serial_rate = measurePlayoutRate(MCTS(game, 200, 1), game)
+    parallel = MCTS(game, 200, 1, workers=workers, parallel='tree')
+    parallel_rate = measurePlayoutRate(parallel, game)
+    parallel.close()
+    serial_playouts = max(1, int(serial_rate*seconds_per_move))
+    parallel_playouts = max(1, int(parallel_rate*seconds_per_move))
+    print("Tree parallel MCTS,", workers, "workers,", seconds_per_move, "seconds per move")
+    print(f"serial: {serial_rate:.1f} playouts/sec, tree parallel: {parallel_rate:.1f} playouts/sec")
+    wins = losses = draws = 0
+    start = time.perf_counter()
+    for i in range(games):
+        random.seed(i)
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        parallel_player = 1 if i % 2 == 0 else 2
+        serial_player = game.nextPlayer(parallel_player)
+        agents = {parallel_player: MCTS(game, parallel_playouts, parallel_player, workers=workers, parallel='tree'),
+                  serial_player: MCTS(game, serial_playouts, serial_player)}
+        winner = play_game(agents[1], agents[2], game).winner
+        agents[parallel_player].close()
+        if winner == parallel_player:
+            wins += 1
+        elif winner == 0:
+            draws += 1
+        else:
+            losses += 1
+    elapsed = time.perf_counter() - start
+    print(f"tree parallel wins {wins}, losses {losses}, draws {draws} in {elapsed:.1f} s")
+    print(f"win rate {wins/games:.2f}, wins per wall-clock second {wins/elapsed:.3f}")
+
+
+#cost per playout of BatchRollout for a few batch sizes against MCTS.playout
+def benchmarkBatchRollout(ROW_COUNT=6, COLUMN_COUNT=5, playouts=2000, batch_sizes=(1, 16, 64, 256, 1024)):
+    random.seed(0)
+    np.random.seed(0)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    algo = MCTS(game, 0, 1)
+    start = time.perf_counter()
+    for i in range(playouts):
+        algo.playout(game.state)
+    serial_cost = (time.perf_counter() - start)/playouts
+    print("Batch rollouts,", ROW_COUNT, "x", COLUMN_COUNT, "board")
+    print(f"MCTS.playout: {serial_cost*1e6:.1f} us per playout")
+    print("batch  us/playout  speedup")
+    batcher = BatchRollout(ROW_COUNT, COLUMN_COUNT)
+    for K in batch_sizes:
+        batches = max(1, playouts//K)
+        start = time.perf_counter()
+        for i in range(batches):
+            batcher.playout(game.state, 1, K)
+        cost = (time.perf_counter() - start)/(batches*K)
+        print(f"{K:5d}  {cost*1e6:10.1f}  {serial_cost/cost:7.2f}")
+
+
+#node counts and table hit rates with and without a transposition table on the same positions
+def benchmarkTranspositions(ROW_COUNT=6, COLUMN_COUNT=5, n_playouts=200, max_size=100000, plies=10):
+    random.seed(0)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    positions = []
+    player = 1
+    for i in range(plies):
+        positions.append((game.state.copy(), player))
+        game.playMove(random.choice(game.validMoves(game.state)), player)
+        if game.checkTerminalState(game.state, player)[0]:
+            break
+        player = game.nextPlayer(player)
+    print("Transposition table,", ROW_COUNT, "x", COLUMN_COUNT, "board,", n_playouts, "playouts per move")
+    print("ply  nodes (tree)  nodes (dag)  hits  hit rate  evictions")
+    total_tree = total_dag = 0
+    for ply, (state, player) in enumerate(positions):
+        random.seed(ply)
+        tree = MCTS(game, n_playouts, player)
+        tree.bestMove(state, player)
+        random.seed(ply)
+        dag = MCTS(game, n_playouts, player, transpositions=max_size)
+        dag.bestMove(state, player)
+        stats = dag.tt.stats()
+        total_tree += tree.nodes_created
+        total_dag += dag.nodes_created
+        print(f"{ply:3d}  {tree.nodes_created:12d}  {dag.nodes_created:11d}  {stats['hits']:4d}  {stats['hit_rate']:8.2f}  {stats['evictions']:9d}")
+    print(f"total nodes {total_tree} -> {total_dag} ({100*(1 - total_dag/max(1, total_tree)):.1f}% fewer)")
+
+
+#time per bestChild call at every depth of a searched tree, scalar loop against the array path
+def benchmarkSelection(ROW_COUNT=6, COLUMN_COUNT=7, n_playouts=3000, repeats=200):
+    random.seed(0)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    algo = MCTS(game, n_playouts, 1)
+    algo.bestMove(game.state, 1)
+    levels = []
+    level = [algo.root]
+    while level:
+        inner = [node for node in level if node.children]
+        if not inner:
+            break
+        levels.append(inner)
+        level = [child for node in inner for child in node.children]
+    random.seed(0)
+    array_algo = ArrayMCTS(game, n_playouts, 1)
+    array_algo.bestMove(game.state, 1)
+    store = array_algo.store
+    array_levels = []
+    level = [0]
+    while level:
+        inner = [node for node in level if store.n_children[node] > 0]
+        if not inner:
+            break
+        array_levels.append(inner)
+        level = [child for node in inner for child in range(store.first_child[node], store.first_child[node] + store.n_children[node])]
+    print("UCB selection,", ROW_COUNT, "x", COLUMN_COUNT, "board, tree from", n_playouts, "playouts")
+    print("depth  nodes  scalar us  vectorized us  array store us")
+    for depth, nodes in enumerate(levels):
+        sample = nodes[:50]
+        costs = []
+        for vectorized in (False, True):
+            algo.vectorized = vectorized
+            start = time.perf_counter()
+            for i in range(repeats):
+                for node in sample:
+                    algo.bestChild(node)
+            costs.append((time.perf_counter() - start)/(repeats*len(sample)))
+        array_cost = float('nan')
+        if depth < len(array_levels):
+            array_sample = array_levels[depth][:50]
+            start = time.perf_counter()
+            for i in range(repeats):
+                for node in array_sample:
+                    array_algo.bestChild(node)
+            array_cost = (time.perf_counter() - start)/(repeats*len(array_sample))
+        print(f"{depth:5d}  {len(nodes):5d}  {costs[0]*1e6:9.2f}  {costs[1]*1e6:13.2f}  {array_cost*1e6:14.2f}")
+
+
+#Q-table lookups per second and key memory, sha1 keys from hashable against the zobrist key
+def benchmarkQLookups(ROW_COUNT=3, COLUMN_COUNT=5, states=2000, repeats=5):
+    random.seed(0)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    boards = []
+    while len(boards) < states:
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        player = 1
+        while not game.checkTerminalState(game.state, game.nextPlayer(player))[0] and len(boards) < states:
+            game.playMove(random.choice(game.validMoves(game.state)), player)
+            boards.append(game.state.copy())
+            player = game.nextPlayer(player)
+    old_table = defaultdict(lambda: defaultdict(lambda: 0))
+    start = time.perf_counter()
+    for i in range(repeats):
+        for board in boards:
+            old_table[hashable(board).wrap()][0] += 1
+    old_rate = repeats*len(boards)/(time.perf_counter() - start)
+    new_table = defaultdict(lambda: defaultdict(lambda: 0))
+    start = time.perf_counter()
+    for i in range(repeats):
+        for board in boards:
+            new_table[game.hashState(board)][0] += 1
+    new_rate = repeats*len(boards)/(time.perf_counter() - start)
+    #the game's own board: the key was already updated by playMove, stateKey only checks it
+    keyed = [(board, game.hashState(board), game.countMoves(board)) for board in boards]
+    incremental_table = defaultdict(lambda: defaultdict(lambda: 0))
+    start = time.perf_counter()
+    for i in range(repeats):
+        for board, key, moves in keyed:
+            game.state, game.key, game.key_moves = board, key, moves
+            incremental_table[game.stateKey(game.state)][0] += 1
+    incremental_rate = repeats*len(boards)/(time.perf_counter() - start)
+    old_bytes = sum(sys.getsizeof(key) for key in old_table)/len(old_table)
+    new_bytes = sum(sys.getsizeof(key) for key in new_table)/len(new_table)
+    print("Q-table lookups,", ROW_COUNT, "x", COLUMN_COUNT, "board,", len(old_table), "states")
+    print(f"sha1 hashable:       {old_rate:10.0f} lookups/sec, {old_bytes:.0f} bytes per key")
+    print(f"zobrist hashState:   {new_rate:10.0f} lookups/sec, {new_bytes:.0f} bytes per key")
+    print(f"incremental key:     {incremental_rate:10.0f} lookups/sec")
+    print(f"binary table record: {qTableDtype(COLUMN_COUNT).itemsize} bytes per state")
+
+
+#Q-table size with and without mirror canonicalization after the same training games, and how
+#many updates every stored (state, action) pair has had on average
+def benchmarkSymmetry(boards=((2, 5), (3, 5)), episodes=(500, 1000, 2000, 4000), seed=0):
+    print("board  episodes  symmetric  states   pairs  updates per pair")
+    for ROW_COUNT, COLUMN_COUNT in boards:
+        for symmetric in (False, True):
+            random.seed(seed)
+            algo = QLearning(None, 2, symmetric=symmetric)
+            trained = 0
+            for target in episodes:
+                while trained < target:
+                    qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT)
+                    trained += 1
+                pairs = sum(len(row) for row in algo.N.values())
+                updates = sum(sum(row.values()) for row in algo.N.values())
+                print(f"{ROW_COUNT}x{COLUMN_COUNT}  {target:8d}  {str(symmetric):>9}  {len(algo.Q):6d}  {pairs:6d}  {updates/pairs:16.2f}")
+
+
+#episodes/sec of the plain one-game-at-a-time loop against trainQLearning with growing worker counts
+def benchmarkQTraining(ROW_COUNT=4, COLUMN_COUNT=5, episodes=2000, batch_episodes=100, worker_counts=None):
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1]*2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1]*2)
+    print("Q-learning training,", ROW_COUNT, "x", COLUMN_COUNT, "board,", episodes, "episodes against a random player")
+    print("mode       workers  episodes/sec  updates/sec  states  speedup")
+    random.seed(0)
+    algo = QLearning(None, 2)
+    start = time.perf_counter()
+    for i in range(episodes):
+        qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT)
+    seconds = time.perf_counter() - start
+    base_rate = episodes/seconds
+    updates = sum(sum(row.values()) for row in algo.N.values())
+    print(f"serial     {1:7d}  {base_rate:12.1f}  {updates/seconds:11.1f}  {len(algo.Q):6d}  {1:7.2f}")
+    for workers in worker_counts:
+        algo = QLearning(None, 2)
+        stats = trainQLearning(algo, ROW_COUNT, COLUMN_COUNT, episodes, workers, batch_episodes)
+        print(f"parallel   {workers:7d}  {stats['episodes_per_sec']:12.1f}  {stats['experiences_per_sec']:11.1f}"
+              f"  {stats['states']:6d}  {stats['episodes_per_sec']/base_rate:7.2f}")
+
+
+#training speed and table memory of the dict Q-table against DenseQTable, the dicts are measured
+#with tracemalloc in a second, untimed run so the games themselves are not counted
+def benchmarkDenseQ(boards=((2, 5), (3, 5)), episodes=4000):
+    import tracemalloc
+    print("board  table  states    rows  table bytes  bytes/state  episodes/sec")
+    for ROW_COUNT, COLUMN_COUNT in boards:
+        for dense in (False, True):
+            random.seed(0)
+            table = DenseQTable.build(ROW_COUNT, COLUMN_COUNT, player=2) if dense else None
+            algo = QLearning(None, 2, dense=table)
+            start = time.perf_counter()
+            for i in range(episodes):
+                qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT)
+            seconds = time.perf_counter() - start
+            if dense:
+                rows, table_bytes = len(table), table.nbytes()
+            else:
+                random.seed(0)
+                algo = QLearning(None, 2)
+                tracemalloc.start()
+                for i in range(episodes):
+                    qLearningEpisode(algo, ROW_COUNT, COLUMN_COUNT)
+                rows, table_bytes = algo.states(), tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            print(f"{ROW_COUNT}x{COLUMN_COUNT}  {'dense' if dense else 'dict':>5}  {algo.states():6d}  {rows:6d}  {table_bytes:11d}"
+                  f"  {table_bytes/algo.states():11.1f}  {episodes/seconds:12.1f}")
+
+
+#full solves of the small boards from the empty position, then MCTS with and without the
+#endgame solver against each other (each side plays first in half of the games)
+def benchmarkSolver(boards=((2, 5), (3, 5), (4, 5)), threshold=10, games=20, n_playouts=200):
+    print("board  result  best move   nodes  seconds")
+    for ROW_COUNT, COLUMN_COUNT in boards:
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        solver = Solver(game)
+        start = time.perf_counter()
+        score, move = solver.solve(game.state, 1)
+        result = 'win' if score > 0 else 'loss' if score < 0 else 'draw'
+        print(f"{ROW_COUNT}x{COLUMN_COUNT}  {result:>6}  {move:9d}  {solver.nodes:6d}  {time.perf_counter() - start:7.2f}")
+    print(f"MCTS{n_playouts} with solver_threshold={threshold} against MCTS{n_playouts}, 6 x 5 board")
+    random.seed(0)
+    results = defaultdict(lambda: 0)
+    seconds = defaultdict(lambda: 0.0)
+    for i in range(games):
+        game = Connect4(6, 5)
+        solver_player = 1 if i % 2 == 0 else 2
+        agents = {solver_player: MCTS(game, n_playouts, solver_player, solver_threshold=threshold),
+                  game.nextPlayer(solver_player): MCTS(game, n_playouts, game.nextPlayer(solver_player))}
+        record = play_game(agents[1], agents[2], game)
+        for move in record.moves:
+            seconds['solver' if move.player == solver_player else 'plain'] += move.seconds
+        if record.winner == 0:
+            results['draw'] += 1
+        else:
+            results['solver' if record.winner == solver_player else 'plain'] += 1
+    print(f"solver wins {results['solver']}, plain wins {results['plain']}, draws {results['draw']}")
+    print(f"seconds per game: solver {seconds['solver']/games:.2f}, plain {seconds['plain']/games:.2f}")
+
+
+#cost of SearchStats: the same searches with and without instrumentation, then one stats record
+def benchmarkStats(ROW_COUNT=6, COLUMN_COUNT=5, n_playouts=2000, moves=5):
+    print("MCTS instrumentation,", ROW_COUNT, "x", COLUMN_COUNT, "board,", n_playouts, "playouts per move")
+    elapsed = {}
+    for stats in (False, True):
+        random.seed(0)
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        algo = MCTS(game, n_playouts, 1, stats=stats)
+        start = time.perf_counter()
+        for i in range(moves):
+            algo.bestMove(game.state, 1)
+        elapsed[stats] = time.perf_counter() - start
+        print(f"stats={str(stats):5}  {n_playouts*moves/elapsed[stats]:8.1f} iterations/sec")
+    print(f"overhead: {100*(elapsed[True]/elapsed[False] - 1):.1f}%")
+    print(algo.stats.jsonLine())
+
+
+################################################
+#Benchmark suite
+#every metric is {'value', 'unit', 'higher_is_better'}; runBenchmarkSuite writes them with the
+#environment to a JSON file and flags every metric that is worse than the stored baseline by
+#more than tolerance (a fraction of the baseline value). every timing is the best of
+#SUITE_REPEATS runs of the same seeded work, which keeps other load on the machine out of it
+SUITE_REPEATS = 3
+
+def suiteMetric(value, unit, higher_is_better=True):
+    return {'value': float(value), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+#calls per second of fn over items, every item is passed as fn(*item)
+def opsPerSecond(fn, items, repeats):
+    best = math.inf
+    for run in range(SUITE_REPEATS):
+        start = time.perf_counter()
+        for i in range(repeats):
+            for item in items:
+                fn(*item)
+        best = min(best, time.perf_counter() - start)
+    return repeats*len(items)/best
+
+
+#boards of random games, one per move played, player is the one to move next
+def randomPositions(ROW_COUNT, COLUMN_COUNT, count, seed):
+    random.seed(seed)
+    positions = []
+    while len(positions) < count:
+        game = Connect4(ROW_COUNT, COLUMN_COUNT)
+        player = 1
+        while len(positions) < count:
+            game.playMove(random.choice(game.validMoves(game.state)), player)
+            if game.checkTerminalState(game.state, player)[0]:
+                break
+            player = game.nextPlayer(player)
+            positions.append((game.state.copy(), player))
+    return positions
+
+
+def suiteEngine(metrics, seed):
+    game = Connect4(6, 7)
+    positions = randomPositions(6, 7, 500, seed)
+    metrics['check_terminal_state_ops'] = suiteMetric(
+        opsPerSecond(game.checkTerminalState, positions, 5), 'ops/sec')
+    metrics['valid_moves_ops'] = suiteMetric(
+        opsPerSecond(game.validMoves, [(state,) for state, player in positions], 20), 'ops/sec')
+    moves = [(state.copy(), random.choice(game.validMoves(state)), player) for state, player in positions]
+    metrics['play_move_with_copy_ops'] = suiteMetric(
+        opsPerSecond(lambda state, move, player: game.playMoveWithCopy(state.copy(), move, player), moves, 20), 'ops/sec')
+    random.seed(seed)
+    game = Connect4(6, 5)
+    algo = MCTS(game, 1, 1)
+    metrics['playouts_6x5'] = suiteMetric(opsPerSecond(algo.playout, [(game.state,)], 1000), 'playouts/sec')
+
+
+#bytes per Node from tracemalloc, with the board copy a non-compact tree keeps and without
+#(compact trees), plus a NodeStore row
+def suiteMemory(metrics, count=20000):
+    import tracemalloc
+    board = np.zeros((6, 7), dtype=int)
+    for with_board in (False, True):
+        tracemalloc.start()
+        nodes = [Node(copy.deepcopy(board) if with_board else None, None, 0, 1) for i in range(count)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del nodes
+        metrics['node_bytes_with_board' if with_board else 'node_bytes'] = suiteMetric(size/count, 'bytes', False)
+    metrics['node_store_bytes'] = suiteMetric(NodeStore(count).nbytes()/count, 'bytes', False)
+
+
+#bestMove latency over the same random mid-game positions for every playout count
+def suiteLatency(metrics, seed, samples):
+    for ROW_COUNT, COLUMN_COUNT in ((6, 5), (6, 7)):
+        positions = randomPositions(ROW_COUNT, COLUMN_COUNT, max(samples.values()), seed)
+        for n_playouts, count in samples.items():
+            latencies = np.full(count, math.inf)
+            for run in range(SUITE_REPEATS):
+                random.seed(seed)
+                game = Connect4(ROW_COUNT, COLUMN_COUNT)
+                algo = MCTS(game, n_playouts, 1)
+                for i, (state, player) in enumerate(positions[:count]):
+                    algo.player = player
+                    start = time.perf_counter()
+                    algo.bestMove(state, player)
+                    latencies[i] = min(latencies[i], time.perf_counter() - start)
+            for q in (50, 90, 99):
+                name = f"best_move_{ROW_COUNT}x{COLUMN_COUNT}_{n_playouts}_p{q}"
+                metrics[name] = suiteMetric(np.percentile(latencies, q)*1000, 'ms', False)
+
+
+def suiteQLearning(metrics, seed):
+    positions = randomPositions(3, 5, 1000, seed)
+    random.seed(seed)
+    game = Connect4(3, 5)
+    algo = QLearning(game, 2)
+    updates = [(state, random.choice(game.validMoves(state)), random.choice((10, -1, -50))) for state, player in positions]
+    metrics['qlearning_updates'] = suiteMetric(opsPerSecond(algo.updateQ, updates, 2), 'updates/sec')
+    metrics['qlearning_best_moves'] = suiteMetric(
+        opsPerSecond(algo.bestMove, [(state,) for state, player in positions], 2), 'moves/sec')
+
+
+#metrics worse than the baseline by more than tolerance, as (name, value, baseline value)
+def compareToBaseline(metrics, baseline, tolerance):
+    regressions = []
+    for name, metric in metrics.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        if metric['higher_is_better']:
+            worse = metric['value'] < old*(1 - tolerance)
+        else:
+            worse = metric['value'] > old*(1 + tolerance)
+        if worse:
+            regressions.append((name, metric['value'], old))
+    return regressions
+
+
+#runs every benchmark with fixed seeds, writes out_path and compares against baseline_path;
+#save_baseline=True (or a missing baseline) stores this run as the new baseline
+def runBenchmarkSuite(out_path='benchmarks/results.json', baseline_path='benchmarks/baseline.json', tolerance=0.2,
+                      save_baseline=False, seed=0, samples=None):
+    if samples is None:
+        samples = {40: 30, 200: 30, 2000: 10}
+    metrics = {}
+    suiteEngine(metrics, seed)
+    suiteMemory(metrics)
+    suiteLatency(metrics, seed, samples)
+    suiteQLearning(metrics, seed)
+    result = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0], 'numpy': np.__version__,
+              'cpus': os.cpu_count(), 'seed': seed, 'metrics': metrics}
+    for path in (out_path, baseline_path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(out_path, 'w') as f:
+        json.dump(result, f, indent=1)
+    baseline = None
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as f:
+            baseline = json.load(f)['metrics']
+    print(f"{'metric':36}  {'value':>12}  {'baseline':>12}  unit")
+    for name, metric in metrics.items():
+        old = f"{baseline[name]['value']:12.2f}" if baseline is not None and name in baseline else f"{'-':>12}"
+        print(f"{name:36}  {metric['value']:12.2f}  {old}  {metric['unit']}")
+    if baseline is None:
+        with open(baseline_path, 'w') as f:
+            json.dump(result, f, indent=1)
+        print("baseline written to", baseline_path)
+        return []
+    regressions = compareToBaseline(metrics, baseline, tolerance)
+    for name, value, old in regressions:
+        print(f"REGRESSION {name}: {value:.2f} against {old:.2f} in the baseline")
+    if not regressions:
+        print(f"no regressions beyond {tolerance:.0%} of the baseline")
+    return regressions
+
+
+#every policy gets the same thinking time per move as plain MCTS (random playouts), so a win
+#rate above one half means more strength per CPU-second; each side plays first in half the games
+def benchmarkPolicies(policies=('center', 'winblock', 'winblock_center', 'lookahead'), ROW_COUNT=6, COLUMN_COUNT=5,
+                      seconds_per_move=0.1, games=20, backend=Connect4):
+    print(f"rollout policies against random playouts, {ROW_COUNT} x {COLUMN_COUNT} board, {seconds_per_move}s per move")
+    print("policy           iterations/sec  wins  losses  draws")
+    for name in policies:
+        random.seed(0)
+        results = defaultdict(lambda: 0)
+        iterations, seconds = 0, 0.0
+        for i in range(games):
+            game = backend(ROW_COUNT, COLUMN_COUNT)
+            policy_player = 1 if i % 2 == 0 else 2
+            agents = {policy_player: MCTS(game, 0, policy_player, time_limit=seconds_per_move, policy=name),
+                      game.nextPlayer(policy_player): MCTS(game, 0, game.nextPlayer(policy_player), time_limit=seconds_per_move)}
+            record = play_game(agents[1], agents[2], game)
+            for move in record.moves:
+                if move.player == policy_player:
+                    iterations += move.playouts
+                    seconds += move.seconds
+            if record.winner == 0:
+                results['draw'] += 1
+            else:
+                results['win' if record.winner == policy_player else 'loss'] += 1
+        print(f"{name:17}  {iterations/seconds:12.1f}  {results['win']:4d}  {results['loss']:6d}  {results['draw']:5d}")
+
+
+#raw evaluator throughput on random positions, then whole searches with leaf batching
+def benchmarkEvaluator(ROW_COUNT=6, COLUMN_COUNT=5, positions=4096, batch_sizes=(1, 8, 32, 128, 512), n_playouts=2000, moves=3):
+    evaluator = WindowEvaluator(ROW_COUNT, COLUMN_COUNT)
+    game = Connect4(ROW_COUNT, COLUMN_COUNT)
+    samples = randomPositions(ROW_COUNT, COLUMN_COUNT, positions, 0)
+    boards = np.stack([board for board, player in samples])
+    to_move = np.array([player for board, player in samples])[:, None, None]
+    boards = np.where(boards == to_move, 1, np.where(boards == 0, 0, -1)).astype(np.int8)
+    print("Leaf evaluator,", ROW_COUNT, "x", COLUMN_COUNT, "board")
+    print("batch    evals/sec")
+    for B in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, positions - B + 1, B):
+            evaluator(boards[i:i + B])
+        print(f"{B:5d}  {(positions//B)*B/(time.perf_counter() - start):11.1f}")
+    print("MCTS with the evaluator,", n_playouts, "leaves per move")
+    print("batch  iterations/sec")
+    for B in batch_sizes:
+        random.seed(0)
+        algo = MCTS(game, n_playouts, 1, evaluator=evaluator, eval_batch=B)
+        start = time.perf_counter()
+        for i in range(moves):
+            algo.bestMove(game.state, 1)
+        print(f"{B:5d}  {n_playouts*moves/(time.perf_counter() - start):14.1f}")
+
+
+def runBenchmarks():
+    print("Input: \n 1 for root parallel MCTS speedup \n 2 for tree parallel MCTS against serial \n 3 for batch rollouts"
+          " \n 4 for transposition table \n 5 for UCB selection \n 6 for Q-table lookups \n 7 for Q-learning symmetry"
+          " \n 8 for Q-learning training throughput \n 9 for the dense Q-table \n 10 for the endgame solver"
+          " \n 11 for search instrumentation"
+          " \n 12 for the full benchmark suite against the stored baseline \n 13 for rollout policies"
+          " \n 14 for batched leaf evaluation \n 15 for the game server load test")
+    choice = int(input())
+    if choice == 1:
+        benchmarkRootParallel()
+    elif choice == 2:
+        benchmarkTreeParallel()
+    elif choice == 3:
+        benchmarkBatchRollout()
+    elif choice == 4:
+        benchmarkTranspositions()
+    elif choice == 5:
+        benchmarkSelection()
+    elif choice == 6:
+        benchmarkQLookups()
+    elif choice == 7:
+        benchmarkSymmetry()
+    elif choice == 8:
+        benchmarkQTraining()
+    elif choice == 9:
+        benchmarkDenseQ()
+    elif choice == 10:
+        benchmarkSolver()
+    elif choice == 11:
+        benchmarkStats()
+    elif choice == 12:
+        print("Save this run as the new baseline (y/n)?")
+        runBenchmarkSuite(save_baseline=input() in ('y', 'Y'))
+    elif choice == 13:
+        benchmarkPolicies()
+    elif choice == 14:
+        benchmarkEvaluator()
+    elif choice == 15:
+        print("Number of concurrent games?")
+        runLoadTest(games=int(input()))
+    else:
+        print("Enter the correct value")
+
 ################################################
 
 def main():
     print("Welcome to Connect 4!")
-    print("Input: \n 1 for MCTS (part a) \n 2 for Q learning (part c)")
+    print("Input: \n 1 for MCTS (part a) \n 2 for Q learning (part c) \n 3 for benchmarks \n 4 for the C sweep tournament"
+          " \n 5 to build the 6x5 opening book \n 6 to serve games over HTTP")
     choice = int(input())
     #_____________________________MCTS_____________________________________________
     
@@ -307,7 +3460,6 @@ def main():
         player2 = 2
         algo1 = MCTS(game, 200, player1) #change back to 200
         algo2 = MCTS(game, 40, player2) #change back to 40
-        MOVES = 0
 
         print("Do you want to all the states of the game (y/n)?")
         choice = input()
@@ -320,45 +3472,15 @@ def main():
         if seeAll:
             game.PrintGrid(game.state)
 
-        while not game.checkTerminalState(game.get_state(), player1)[0]:
-            if(algo1.bestMove(game.state, player1) in game.validMoves(game.get_state())):
-                game.playMove(algo1.bestMove(game.state, player1), player1)
-                MOVES += 1
-            elif algo1.bestMove(game.state, player1) == 42:
-                if game.checkTerminalState(game.get_state(), player1)[0]:
-                    print("Should NEVER print")
-                    break
-
-            if seeAll:
-                game.PrintGrid(game.state)
-            if game.checkTerminalState(game.get_state(), player1)[0]:
-                break
-            game.player = game.nextPlayer(game.player)
-
-
-            if(algo2.bestMove(game.state, player2) in game.validMoves(game.get_state())):
-                game.playMove(algo2.bestMove(game.state, player2), player2)
-                MOVES += 1
-
-            elif algo2.bestMove(game.state, player2) == 42:
-                if game.checkTerminalState(game.get_state(), player2)[0]:
-                    print("Should NEVER print")
-                    break
-            
-            if seeAll:
-                game.PrintGrid(game.state)
-            if game.checkTerminalState(game.get_state(), player2)[0]:
-                break
-            game.player = game.nextPlayer(game.player)
+        result = play_game(algo1, algo2, game, printMove if seeAll else None)
 
         print("Final State:")
         game.PrintGrid(game.get_state())
-        winner = game.checkTerminalState(game.get_state(), game.player)[1]
-        if(winner == 0):
+        if(result.winner == 0):
             print("The game is a draw")
         else:
-            print("The player who won is:", winner)
-        print("Number of moves:", MOVES)
+            print("The player who won is:", result.winner)
+        print("Number of moves:", len(result.moves))
         return
 
 
@@ -467,39 +3589,15 @@ def main():
         game.PrintGrid(game.state)
         algo1 = MCTS(game, 200, player1)
         algo2 = QLearning(game, player2)
-        MOVES = 0
-        while not game.checkTerminalState(game.get_state(), player1)[0]:
-            print("MCTS")
-            if(algo1.bestMove(game.state, player1) in game.validMoves(game.get_state())):
-                game.playMove(algo1.bestMove(game.state, player1), 1)
-                MOVES += 1
-            #game.PrintGrid(game.state)
-            if game.checkTerminalState(game.get_state(), player1)[0]:
-                break
-            game.player = game.nextPlayer(game.player)
-            game.PrintGrid(game.get_state())
-            
-            
-            
-            print("QLearning")
-
-            if(algo2.bestMove(game.state) in game.validMoves(game.get_state())):
-                game.playMove(algo2.bestMove(game.state), 2)
-                MOVES += 1
-            #game.PrintGrid(game.state)
-            if game.checkTerminalState(game.get_state(), player2)[0]:
-                break
-            game.player = game.nextPlayer(game.player)
-            game.PrintGrid(game.get_state())
+        result = play_game(algo1, algo2, game, printMove)
 
         print("Final State:")
         game.PrintGrid(game.get_state())
-        winner = game.checkTerminalState(game.get_state(), game.player)[1]
-        if(winner == 0):
+        if(result.winner == 0):
             print("The game is a draw")
         else:
-            print("The player who won is:", winner)   
-        print("Number of moves:", MOVES)
+            print("The player who won is:", result.winner)   
+        print("Number of moves:", len(result.moves))
         return
 
 
@@ -634,6 +3732,24 @@ def main():
         
         
         # return
+    #_________________________________BENCHMARKS____________________________________________
+    elif choice == 3:
+        runBenchmarks()
+        return
+    #_________________________________TOURNAMENT____________________________________________
+    elif choice == 4:
+        sweepC()
+        return
+    #_________________________________OPENING BOOK__________________________________________
+    elif choice == 5:
+        book = OpeningBook.generate('opening_book_6x5.npy', 6, 5)
+        print("Opening book with", len(book), "positions written to opening_book_6x5.npy")
+        return
+    #_________________________________GAME SERVER___________________________________________
+    elif choice == 6:
+        print("Port?")
+        serveGames(port=int(input()))
+        return
     #_________________________________BASE GAME____________________________________________
     else:
         print("Enter the correct value")
@@ -0,0 +1,1032 @@
+import asyncio
+import importlib
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+c4 = importlib.import_module('2019A7PS0044G_AKHILESH') #registered by name so worker processes can unpickle its functions
+
+
+def randomGame(seed, ROW_COUNT, COLUMN_COUNT, pieces):
+    rng = random.Random(seed)
+    game = c4.Connect4(ROW_COUNT, COLUMN_COUNT)
+    player = 1
+    for i in range(pieces):
+        game.playMove(rng.choice(game.validMoves(game.state)), player)
+        if game.checkTerminalState(game.state, player)[0]:
+            return None, None
+        player = game.nextPlayer(player)
+    return game, player
+
+
+#plain negamax over every line, scored like Solver: cells - pieces before the winning move
+def bruteForce(game, board, player, moves):
+    best = -math.inf
+    for col in game.validMoves(board):
+        row = game.dropPiece(board, col, player)
+        terminal_state, winner = game.checkLastMove(board, row, col, player, moves + 1)
+        if terminal_state:
+            score = game.ROW_COUNT*game.COLUMN_COUNT - moves if winner == player else 0
+        else:
+            score = -bruteForce(game, board, game.nextPlayer(player), moves + 1)
+        game.unplayMove(board, col)
+        best = max(best, score)
+    return best
+
+
+################################################
+#backends
+
+@pytest.mark.parametrize('seed', range(20))
+def test_bitboard_matches_array_backend(seed):
+    rng = random.Random(seed)
+    array_game = c4.Connect4(6, 7)
+    bit_game = c4.BitboardConnect4(6, 7)
+    player = 1
+    while True:
+        assert np.array_equal(bit_game.toArray(bit_game.state), array_game.state)
+        assert bit_game.validMoves(bit_game.state) == array_game.validMoves(array_game.state)
+        assert bit_game.countMoves(bit_game.state) == array_game.countMoves(array_game.state)
+        assert bit_game.key == array_game.key
+        for p in (1, 2):
+            assert sorted(bit_game.winningMoves(bit_game.state, p)) == sorted(array_game.winningMoves(array_game.state, p))
+        assert np.array_equal(bit_game.toArray(bit_game.fromArray(array_game.state)), array_game.state)
+        col = rng.choice(array_game.validMoves(array_game.state))
+        copied = bit_game.playMoveWithCopy(bit_game.state.copy(), col, player)
+        array_game.playMove(col, player)
+        bit_game.playMove(col, player)
+        assert np.array_equal(bit_game.toArray(copied), array_game.state)
+        array_result = array_game.checkTerminalState(array_game.state, player)
+        assert bit_game.checkTerminalState(bit_game.state, player) == array_result
+        if array_result[0]:
+            break
+        player = array_game.nextPlayer(player)
+
+
+def test_bitboard_rejects_wrong_board_shape():
+    with pytest.raises(ValueError):
+        c4.BitboardConnect4(6, 7).fromArray(np.zeros((6, 5), dtype=int))
+
+
+@pytest.mark.parametrize('backend', [c4.Connect4, c4.BitboardConnect4])
+def test_last_move_check_matches_full_scan(backend):
+    for seed in range(30):
+        rng = random.Random(seed)
+        game = backend(6, 5)
+        player, moves = 1, 0
+        while True:
+            col = rng.choice(game.validMoves(game.state))
+            row = game.dropPiece(game.state, col, player)
+            moves += 1
+            assert game.countMoves(game.state) == moves
+            result = game.checkLastMove(game.state, row, col, player, moves)
+            assert result == game.checkTerminalState(game.state, player)
+            if result[0]:
+                break
+            player = game.nextPlayer(player)
+
+
+@pytest.mark.parametrize('backend', [c4.Connect4, c4.BitboardConnect4])
+def test_unplay_move_takes_back_drop_piece(backend):
+    rng = random.Random(0)
+    game = backend(6, 5)
+    empty = game.toArray(game.state).copy()
+    played, player = [], 1
+    for i in range(20):
+        col = rng.choice(game.validMoves(game.state))
+        row = game.dropPiece(game.state, col, player)
+        played.append((col, row))
+        player = game.nextPlayer(player)
+    for col, row in reversed(played):
+        assert game.unplayMove(game.state, col) == row
+    assert np.array_equal(game.toArray(game.state), empty)
+    assert game.countMoves(game.state) == 0
+    assert game.unplayMove(game.state, 0) == -1
+
+
+def test_zobrist_hash_follows_the_moves():
+    rng = random.Random(0)
+    game = c4.Connect4(6, 5)
+    key, player = 0, 1
+    for i in range(20):
+        col = rng.choice(game.validMoves(game.state))
+        row = game.dropPiece(game.state, col, player)
+        key = game.updateHash(key, row, col, player)
+        assert key == game.hashState(game.state) == c4.Connect4(6, 5).hashState(game.state.copy())
+        player = game.nextPlayer(player)
+
+
+def test_mcts_runs_on_bitboards():
+    random.seed(0)
+    game = c4.BitboardConnect4(6, 5)
+    move = c4.MCTS(game, 50, 1).bestMove(game.state, 1)
+    assert move in game.validMoves(game.state)
+
+
+@pytest.mark.parametrize('backend', [c4.Connect4, c4.BitboardConnect4])
+def test_state_key_is_kept_up_to_date(backend):
+    rng = random.Random(0)
+    game = backend(6, 5)
+    player = 1
+    for i in range(12):
+        game.playMove(rng.choice(game.validMoves(game.state)), player)
+        player = game.nextPlayer(player)
+        assert game.stateKey(game.state) == game.hashState(game.state)
+    other = game.playMoveWithCopy(game.state, game.validMoves(game.state)[0], player)
+    assert game.stateKey(other) == game.hashState(other) != game.key
+
+
+def test_canonical_key_matches_the_mirror_image():
+    for seed in range(10):
+        game, player = randomGame(seed, 6, 5, 8)
+        if game is None:
+            continue
+        mirror = game.state[:, ::-1].copy()
+        key, mirrored = game.canonicalKey(game.state)
+        assert game.canonicalKey(game.state.copy()) == (key, mirrored)
+        assert game.canonicalKey(mirror)[0] == key
+        assert key == min(game.hashState(game.state), game.hashState(mirror))
+
+
+################################################
+#search
+
+#plays agents[1] against agents[2] from the position of game, returns the winner
+def playGame(agents, game, player=1):
+    while True:
+        game.playMove(agents[player].bestMove(game.state, player), player)
+        terminal_state, winner = game.checkTerminalState(game.state, player)
+        if terminal_state:
+            return winner
+        player = game.nextPlayer(player)
+
+
+@pytest.mark.parametrize('options', [{}, {'compact': True}])
+def test_mcts_beats_random_player(options):
+    for i in range(6):
+        random.seed(i)
+        game = c4.Connect4(6, 5)
+        mcts_player = 1 if i % 2 == 0 else 2
+        agents = {mcts_player: c4.MCTS(game, 200, mcts_player, **options),
+                  3 - mcts_player: c4.RandomPlayer(game, 3 - mcts_player)}
+        assert playGame(agents, game) == mcts_player
+
+
+#player 1 to move wins in column 3, every other move but 4 lets player 2 win in column 4
+def threatPosition():
+    game = c4.Connect4(6, 5)
+    for col in (0, 1, 2):
+        game.playMove(col, 1)
+        game.playMove(4, 2)
+    return game
+
+
+#the backed-up rewards are those of the player to move at the root, whichever side made the last move
+@pytest.mark.parametrize('options', [{}, {'compact': True}])
+def test_rewards_are_scored_for_the_root_player(options):
+    random.seed(0)
+    game = threatPosition()
+    board = game.state.copy()
+    algo = c4.MCTS(game, 300, 1, **options)
+    assert algo.bestMove(game.state, 1) == 3
+    assert np.array_equal(game.state, board)
+    children = {child.action: child for child in algo.root.children}
+    win = children[3]
+    assert win.terminal and win.winner == 1 and win.score > 0
+    losses = [grandchild for action, child in children.items() if action not in (3, 4)
+              for grandchild in child.children if grandchild.action == 4]
+    assert losses and all(loss.terminal and loss.winner == 2 and loss.score <= 0 for loss in losses)
+    assert any(loss.score < 0 for loss in losses)
+    assert all(children[action].score < 0 for action in children if action not in (3, 4) and children[action].children)
+
+
+def test_root_parallel_merges_worker_trees():
+    random.seed(0)
+    game = threatPosition()
+    algo = c4.MCTS(game, 100, 1, workers=2)
+    try:
+        assert algo.bestMove(game.state, 1) == 3
+        pool = algo.pool
+        assert sorted(child.action for child in algo.root.children) == game.validMoves(game.state)
+        assert algo.root.visits == sum(child.visits for child in algo.root.children)
+        assert algo.bestMove(game.state, 1) == 3
+        assert algo.pool is pool #kept between moves
+    finally:
+        algo.close()
+    assert algo.pool is None
+
+
+#stands in for the process pool with fixed worker results: (action, visits, score) per root child
+class FixedResultsPool():
+    def __init__(self, results):
+        self.results = results
+
+    def map(self, function, jobs):
+        return self.results[:len(jobs)]
+
+
+def test_root_parallel_picks_the_most_visited_child():
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 100, 1, workers=2)
+    pool = FixedResultsPool([[(0, 3, 3.0), (1, 50, -20.0), (2, 20, -40.0)], [(0, 2, 2.0), (1, 40, -10.0), (2, 30, -30.0)]])
+    algo.getPool = lambda: pool
+    assert algo.bestMove(game.state, 1) == 1 #column 0 has the best mean, over 5 visits
+    assert [child.visits for child in algo.root.children] == [5, 90, 50]
+
+
+#4x4 board (printed top row first) with only the top of column 0 empty: player 2 is to move and wins
+#there, a piece of player 1 would fill the board for a draw
+def lastCellBoard():
+    return np.array([[0, 2, 2, 1], [2, 1, 1, 1], [2, 1, 1, 1], [2, 1, 2, 2]])[::-1].copy()
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_playouts_start_with_the_player_to_move(compact):
+    game = c4.Connect4(4, 4)
+    board = lastCellBoard()
+    algo = c4.MCTS(game, 0, 1, compact=compact)
+    algo.scratch = board
+    assert algo.playout(board, 15, 2) == 2
+    assert algo.playout(board, 15, 1) == 0
+    assert algo.playoutInPlace(board, 15, 2) == 2
+    assert np.array_equal(board, lastCellBoard())
+    node = c4.Node(board, None, None, 2)
+    node.moves = 15
+    assert algo.simulate(node) == 2
+    assert c4.playoutWorker((game, board, 2, 15, None, 0)) == 2
+
+
+@pytest.mark.parametrize('options', [{}, {'reuse_tree': True}])
+def test_failed_expand_leaves_the_callers_board_alone(options):
+    game = c4.Connect4(6, 7)
+    before = game.state.copy()
+    algo = c4.MCTS(game, 0.1, 50, **options)
+
+    def fail(*args):
+        raise RuntimeError('check failed')
+
+    algo.game.checkLastMove = fail #raises right after the first probe move of the root
+    with pytest.raises(RuntimeError):
+        algo.bestMove(game.state, 1)
+    assert np.array_equal(game.state, before)
+
+
+def test_tree_parallel_search():
+    random.seed(0)
+    game = threatPosition()
+    algo = c4.MCTS(game, 200, 1, workers=2, parallel='tree')
+    try:
+        assert algo.bestMove(game.state, 1) == 3
+    finally:
+        algo.close()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_win_check_matches_full_scan(seed):
+    rng = np.random.RandomState(seed)
+    game = c4.Connect4(6, 5)
+    boards = rng.randint(0, 3, size=(200, 6, 5)).astype(np.int8)
+    batcher = c4.BatchRollout(6, 5)
+    for player in (1, 2):
+        expected = [game.checkTerminalState(board, player) == (True, player) for board in boards]
+        assert batcher.checkWins(boards, player).tolist() == expected
+
+
+def test_batch_playouts_start_with_the_player_to_move():
+    batcher = c4.BatchRollout(4, 4)
+    assert batcher.playout(lastCellBoard(), 2, 16).tolist() == [2]*16
+    assert batcher.playout(lastCellBoard(), 1, 16).tolist() == [0]*16
+    winners = batcher.playout(np.zeros((4, 4), dtype=int), 1, 64)
+    assert set(winners.tolist()) <= {0, 1, 2}
+    algo = c4.MCTS(c4.Connect4(4, 4), 0, 1, batch_playouts=8)
+    node = c4.Node(lastCellBoard(), None, None, 2)
+    node.moves = 15
+    algo.root = c4.Node(np.zeros((4, 4), dtype=int), None, None, 1)
+    assert algo.evaluateLeaf(node) == algo.calcReward(2, 1)
+
+
+def test_mcts_with_batch_playouts():
+    random.seed(0)
+    np.random.seed(0)
+    game = threatPosition()
+    assert c4.MCTS(game, 100, 1, batch_playouts=16).bestMove(game.state, 1) == 3
+
+
+def treeDepth(node):
+    return 1 + max(treeDepth(child) for child in node.children) if node.children else 0
+
+
+def test_selection_descends_below_two_plies():
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 400, 1)
+    algo.bestMove(game.state, 1)
+    assert treeDepth(algo.root) > 3
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_tree_reuse_keeps_the_subtree_after_the_reply(compact):
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 300, 1, reuse_tree=True, compact=compact)
+    move = algo.bestMove(game.state, 1)
+    child = next(child for child in algo.root.children if child.action == move)
+    reply = max(child.children, key=lambda grandchild: grandchild.visits)
+    visits = reply.visits
+    game.playMove(move, 1)
+    game.playMove(reply.action, 2)
+    assert algo.bestMove(game.state, 1) in game.validMoves(game.state)
+    assert algo.reused_visits == visits > 1
+    assert algo.root.parent is None
+    algo.bestMove(c4.Connect4(6, 5).state, 1) #not in the tree
+    assert algo.reused_visits == 0
+
+
+def test_transpositions_share_nodes():
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 400, 1, transpositions=10000)
+    algo.bestMove(game.state, 1)
+    assert algo.tt.stats()['hits'] > 0
+    parents = {}
+    stack, seen = [algo.root], set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        assert node.key == game.hashState(node.state)
+        for child in node.children:
+            parents.setdefault(id(child), set()).add(id(node))
+            changed = np.flatnonzero((child.state != node.state).any(axis=0))
+            assert changed.tolist() == [algo.childAction(node, child)]
+            stack.append(child)
+    assert max(len(ids) for ids in parents.values()) > 1
+
+
+@pytest.mark.parametrize('options', [{'transpositions': 1000, 'reuse_tree': True},
+                                     {'transpositions': 1000, 'compact': True},
+                                     {'transpositions': 1000, 'workers': 2},
+                                     {'workers': 2, 'time_limit': 0.1},
+                                     {'workers': 2, 'max_nodes': 100},
+                                     {'evaluator': c4.WindowEvaluator(6, 5), 'transpositions': 1000},
+                                     {'evaluator': c4.WindowEvaluator(6, 5), 'workers': 2}])
+def test_unsupported_options_are_refused(options):
+    with pytest.raises(ValueError):
+        c4.MCTS(c4.Connect4(6, 5), 10, 1, **options)
+
+
+def test_per_call_budget_refused_for_parallel_search():
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 10, 1, workers=2)
+    with pytest.raises(ValueError):
+        algo.bestMove(game.state, 1, time_limit=0.1)
+    algo.close()
+
+
+def test_terminal_leaves_count_their_visits():
+    random.seed(0)
+    game = threatPosition()
+    algo = c4.MCTS(game, 300, 1)
+    algo.bestMove(game.state, 1)
+    for child in algo.root.children:
+        for node in [child] + child.children:
+            if node.terminal: #one visit from expand, then one per reward
+                assert node.score == (node.visits - 1)*algo.calcReward(node.winner, 1)
+
+
+def test_time_limit_bounds_the_search():
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 10**6, 1, time_limit=0.2)
+    start = time.perf_counter()
+    assert algo.bestMove(game.state, 1) in game.validMoves(game.state)
+    assert time.perf_counter() - start < 0.35
+    assert algo.iterations > 0
+
+
+def test_max_nodes_bounds_the_search():
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 10**6, 1)
+    assert algo.bestMove(game.state, 1, max_nodes=300) in game.validMoves(game.state)
+    assert 0 < algo.nodes_created <= 300 + game.COLUMN_COUNT
+    assert algo.iterations > 0
+
+
+#a 5x5 position with 5 empty cells and no immediate win, its whole tree has far fewer than 500 nodes
+def endgamePosition():
+    for seed in range(100):
+        game, player = randomGame(seed, 5, 5, 20)
+        if game is not None and not any(game.winningMoves(game.state, p) for p in (1, 2)):
+            return game, player
+
+
+@pytest.mark.parametrize('agent', [c4.MCTS, c4.ArrayMCTS])
+def test_max_nodes_stops_when_the_tree_runs_out(agent):
+    game, player = endgamePosition()
+    algo = agent(game, 60, player, max_nodes=500)
+    assert algo.bestMove(game.state, player) in game.validMoves(game.state)
+    assert algo.nodes_created < 500 and algo.exhausted()
+    assert algo.iterations <= c4.MAX_ITERATIONS_PER_NODE*500
+
+
+def test_max_nodes_search_plays_to_the_end():
+    random.seed(0)
+    game = c4.Connect4(5, 5)
+    agents = {1: c4.MCTS(game, 60, 1, max_nodes=200), 2: c4.RandomPlayer(game, 2)}
+    assert playGame(agents, game) in (0, 1, 2)
+
+
+def test_node_store_add_and_clear():
+    store = c4.NodeStore(3)
+    assert store.add(-1, -1, 1, 0) == 0
+    assert store.add(0, 2, 2, 1) == 1
+    assert store.add(0, 3, 2, 1) == 2
+    assert store.add(0, 4, 2, 1) == -1 #full
+    assert store.parent[1] == 0 and store.action[2] == 3 and store.player[1] == 2
+    store.visits[:3] = 5
+    store.clear()
+    assert store.size == 0 and not store.visits.any() and (store.parent == -1).all()
+
+
+def test_array_mcts_search():
+    random.seed(0)
+    game = threatPosition()
+    algo = c4.ArrayMCTS(game, 300, 1)
+    assert algo.bestMove(game.state, 1) == 3
+    store = algo.store
+    first = store.first_child[0]
+    assert sorted(store.action[first:first + store.n_children[0]].tolist()) == game.validMoves(game.state)
+    assert store.winner[first + 3] == 1 and store.score[first + 3] > 0
+    assert algo.bestMove(game.state, 1, max_nodes=200) == 3
+    assert c4.ArrayMCTS(game, 300, 1, capacity=50).bestMove(game.state, 1) in game.validMoves(game.state)
+
+
+def test_array_mcts_max_nodes_stops_when_the_store_is_full():
+    game = c4.Connect4(6, 5)
+    algo = c4.ArrayMCTS(game, 60, 1, capacity=50, max_nodes=5000)
+    assert algo.bestMove(game.state, 1) in game.validMoves(game.state)
+    assert algo.store.size <= 50 and algo.exhausted()
+    assert algo.iterations < 1000
+
+
+def test_array_mcts_playouts_start_with_the_player_to_move():
+    algo = c4.ArrayMCTS(c4.Connect4(4, 4), 0, 1)
+    algo.scratch = lastCellBoard()
+    algo.store.add(-1, -1, 2, 15)
+    assert algo.evaluateLeaf(0) == algo.calcReward(2, 2)
+
+
+def test_vectorized_best_child_matches_the_loop():
+    random.seed(0)
+    game = c4.Connect4(6, 7)
+    algo = c4.MCTS(game, 500, 1)
+    algo.bestMove(game.state, 1)
+    stack, checked = [algo.root], 0
+    while stack:
+        node = stack.pop()
+        if not node.children:
+            continue
+        ucb = [0.0 if child.visits == 0 else child.score/child.visits + algo.C*math.sqrt(math.log(node.visits)/child.visits)
+               for child in node.children]
+        for vectorized in (False, True):
+            algo.vectorized = vectorized
+            chosen = algo.bestChild(node)
+            assert ucb[node.children.index(chosen)] == pytest.approx(max(ucb))
+        checked += 1
+        stack.extend(node.children)
+    assert checked > 10
+    random.seed(0)
+    assert c4.MCTS(game, 200, 1, vectorized=True).bestMove(game.state, 1) in game.validMoves(game.state)
+
+
+def test_symmetry_expands_one_move_of_each_mirrored_pair():
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 100, 1, symmetry=True)
+    assert algo.bestMove(game.state, 1) in (0, 1, 2)
+    assert sorted(child.action for child in algo.root.children) == [0, 1, 2]
+    game.playMove(0, 1)
+    algo.bestMove(game.state, 2)
+    assert sorted(child.action for child in algo.root.children) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('ROW_COUNT, COLUMN_COUNT, pieces', [(3, 4, 4), (4, 4, 8), (4, 5, 12)])
+def test_solver_matches_brute_force(ROW_COUNT, COLUMN_COUNT, pieces):
+    checked = 0
+    for seed in range(40):
+        game, player = randomGame(seed, ROW_COUNT, COLUMN_COUNT, pieces)
+        if game is None:
+            continue
+        board = game.state.copy()
+        expected = bruteForce(game, board, player, pieces)
+        for backend in (game, c4.BitboardConnect4(ROW_COUNT, COLUMN_COUNT)):
+            score, move = c4.Solver(backend).solve(backend.fromArray(board), player)
+            assert score == expected
+            row = game.dropPiece(board, move, player)
+            terminal_state, winner = game.checkLastMove(board, row, move, player, pieces + 1)
+            if terminal_state:
+                move_score = ROW_COUNT*COLUMN_COUNT - pieces if winner == player else 0
+            else:
+                move_score = -bruteForce(game, board, game.nextPlayer(player), pieces + 1)
+            game.unplayMove(board, move)
+            assert move_score == expected
+        checked += 1
+    assert checked >= 10
+
+
+@pytest.mark.parametrize('agent', [c4.MCTS, c4.ArrayMCTS])
+def test_solver_threshold_finds_the_win(agent):
+    game = c4.Connect4(4, 4)
+    game.state = lastCellBoard()
+    algo = agent(game, 20, 2, solver_threshold=4)
+    assert algo.bestMove(game.state, 2) == 0
+    game = threatPosition()
+    algo = agent(game, 20, 1, solver_threshold=30)
+    assert algo.bestMove(game.state, 1) == 3
+
+
+def test_solver_gives_up_at_deadline():
+    solver = c4.Solver(c4.Connect4(6, 5))
+    solver.deadline = 0.0
+    assert solver.solve(c4.Connect4(6, 5).state, 1) == (None, None)
+    assert solver.winner(c4.Connect4(6, 5).state, 1) is None
+
+
+def test_budget_bounds_solver_threshold():
+    game = c4.Connect4(6, 5)
+    algo = c4.MCTS(game, 200, 1, solver_threshold=29)
+    start = time.perf_counter()
+    assert algo.bestMove(game.state, 1, time_limit=0.2) in game.validMoves(game.state)
+    assert time.perf_counter() - start < 1.0
+
+
+def test_solver_threshold_solves_new_children():
+    game = threatPosition()
+    algo = c4.MCTS(game, 50, 1, solver_threshold=23) #the root has 24 empty cells, its children 23
+    assert algo.bestMove(game.state, 1) == 3
+    assert all(child.terminal for child in algo.root.children)
+    assert {child.action: child.winner for child in algo.root.children} == {0: 2, 1: 2, 2: 2, 3: 1, 4: 1}
+
+    assert algo.root.terminal and algo.root.winner == 1 #proven by the winning child
+
+
+def test_proofs_are_backed_up():
+    algo = c4.MCTS(c4.Connect4(6, 5), 10, 1, solver_threshold=1)
+    top = c4.Node(None, None, None, 2)
+    node = c4.Node(None, top, 0, 1)
+    top.children = [node, c4.Node(None, top, 1, 1)]
+    for winners, proven in (([2, -1], None), ([2, 0], 0), ([2, 2], 2), ([2, 1], 1)):
+        node.terminal, node.winner = False, -1
+        top.terminal, top.winner = False, -1
+        node.children = []
+        for action, winner in enumerate(winners):
+            child = c4.Node(None, node, action, 2)
+            child.terminal, child.winner = winner != -1, winner
+            node.children.append(child)
+        algo.prove(node)
+        assert node.terminal == (proven is not None) and (proven is None or node.winner == proven)
+        #a loss for player 1 is a win for player 2 at the parent, which is proven without its other child
+        assert top.terminal == (proven == 2)
+    assert c4.MCTS(c4.Connect4(6, 5), 10, 1).prove(node) is None #only with solver_threshold
+
+
+@pytest.mark.parametrize('agent', [c4.MCTS, c4.ArrayMCTS])
+def test_proven_root_plays_its_proof(agent):
+    game, player = endgamePosition()
+    expected = c4.Solver(game).winner(game.state, player)
+    algo = agent(game, 200, player, solver_threshold=4) #the root has 5 empty cells, so only its children are solved
+    move = algo.bestMove(game.state, player, time_limit=5)
+    assert algo.rootWinner() == expected and algo.iterations <= 32
+    board = game.playMoveWithCopy(game.state, move, player)
+    assert c4.Solver(game).winner(board, game.nextPlayer(player)) == expected
+
+
+@pytest.mark.parametrize('agent', [c4.MCTS, c4.ArrayMCTS])
+def test_search_stats_record_every_move(agent):
+    game = c4.Connect4(6, 5)
+    algo = agent(game, 60, 1, stats=True)
+    move = algo.bestMove(game.state, 1)
+    record = json.loads(algo.stats.jsonLine())
+    assert record['move'] == move and record['player'] == 1
+    assert record['iterations'] == algo.iterations == 60
+    assert record['playouts'] == record['phase_calls']['playout'] > 0
+    assert record['max_depth'] >= 1 and record['branching_factor'] > 1
+    assert 0 < record['mean_playout_length'] <= record['max_playout_length']
+    assert set(record['phase_seconds']) == set(c4.SearchStats.PHASES)
+    assert sum(record['phase_seconds'].values()) <= record['seconds']
+    game.playMove(move, 1)
+    game.playMove(0, 2)
+    algo.bestMove(game.state, 1)
+    assert 0 < algo.stats.last['playouts'] <= 60 #counters restart with every move
+    assert c4.MCTS(game, 10, 1).stats is None
+
+
+################################################
+#rollout policies
+
+#player 1 threatens to win in column 3 and player 2 is to move
+def blockPosition():
+    game = c4.Connect4(6, 5)
+    for col in (0, 1, 2):
+        game.playMove(col, 1)
+    game.playMove(0, 2)
+    game.playMove(1, 2)
+    return game
+
+
+@pytest.mark.parametrize('policy', ['winblock', 'winblock_center', 'lookahead'])
+def test_policies_win_and_block(policy):
+    game = blockPosition()
+    legal_moves = game.validMoves(game.state)
+    board = game.state.copy()
+    for i in range(10):
+        assert c4.makePolicy(policy).chooseMove(game, game.state, 1, legal_moves) == 3
+        assert c4.makePolicy(policy).chooseMove(game, game.state, 2, legal_moves) == 3
+    assert np.array_equal(game.state, board)
+
+
+@pytest.mark.parametrize('policy', sorted(c4.ROLLOUT_POLICIES))
+def test_policies_play_legal_moves(policy):
+    game = blockPosition()
+    game.playMove(3, 2)
+    for backend in (game, c4.BitboardConnect4(6, 5)):
+        board = backend.fromArray(game.state)
+        legal_moves = [0, 2, 4]
+        assert c4.makePolicy(policy).chooseMove(backend, board, 1, legal_moves) in legal_moves
+
+
+def test_make_policy():
+    policy = c4.WinBlockPolicy()
+    assert c4.makePolicy(policy) is policy
+    assert c4.makePolicy(None) is None
+    assert isinstance(c4.makePolicy('center'), c4.CenterPolicy)
+    with pytest.raises(ValueError):
+        c4.makePolicy('greedy')
+
+
+def test_search_with_a_rollout_policy():
+    game = blockPosition()
+    assert c4.RandomPlayer(game, 2, policy='winblock').bestMove(game.state, 2) == 3
+    for agent in (c4.MCTS, c4.ArrayMCTS):
+        algo = agent(game, 100, 2, policy='winblock')
+        assert algo.bestMove(game.state, 2) == 3
+
+
+
+################################################
+#value evaluators
+
+def test_window_evaluator():
+    evaluator = c4.WindowEvaluator(6, 5)
+    boards = []
+    for seed in range(20):
+        game, player = randomGame(seed, 6, 5, 10)
+        if game is not None:
+            boards.append(np.where(game.state == 0, 0, np.where(game.state == player, 1, -1)).astype(np.int8))
+    boards = np.array(boards)
+    values = evaluator(boards)
+    assert values.shape == (len(boards),)
+    assert np.all(np.abs(values) <= 1) and np.any(values != 0)
+    assert np.allclose(evaluator(boards[:, :, ::-1].copy()), values, atol=1e-6)
+    assert np.allclose(evaluator(-boards), -values, atol=1e-6)
+    assert evaluator(np.zeros((1, 6, 5), dtype=np.int8))[0] == 0
+
+
+def test_leaf_batched_search():
+    evaluator = c4.WindowEvaluator(6, 5)
+    batches = []
+
+    def counted(boards):
+        batches.append(len(boards))
+        return evaluator(boards)
+    random.seed(0)
+    game = threatPosition()
+    algo = c4.MCTS(game, 200, 1, evaluator=counted, eval_batch=16)
+    assert algo.bestMove(game.state, 1) == 3
+    assert 0 < max(batches) <= 16 and len(batches) < 200
+    #every virtual loss was taken back: the children (created with one visit) count each iteration once
+    assert algo.root.visits == algo.iterations == 200
+    assert sum(child.visits - 1 for child in algo.root.children) == 200
+    game = blockPosition()
+    assert c4.MCTS(game, 200, 2, evaluator=evaluator, eval_batch=16).bestMove(game.state, 2) == 3
+
+
+@pytest.mark.parametrize('eval_batch', [1, 8])
+def test_leaf_batched_max_nodes_stops_when_the_tree_runs_out(eval_batch):
+    game, player = endgamePosition()
+    algo = c4.MCTS(game, 60, player, evaluator=c4.WindowEvaluator(5, 5), eval_batch=eval_batch, max_nodes=500)
+    assert algo.bestMove(game.state, player) in game.validMoves(game.state)
+    assert algo.nodes_created < 500 and algo.exhausted()
+    assert algo.iterations <= c4.MAX_ITERATIONS_PER_NODE*500
+
+
+################################################
+#tournaments
+
+def test_wilson_interval():
+    assert c4.wilsonInterval(0, 0) == (0.0, 1.0)
+    low, high = c4.wilsonInterval(5, 10)
+    assert low == pytest.approx(1 - high) and 0.2 < low < 0.25
+    assert c4.wilsonInterval(10, 10)[1] == 1.0 and c4.wilsonInterval(0, 10)[0] == 0.0
+    assert c4.wilsonInterval(50, 100)[1] - c4.wilsonInterval(50, 100)[0] < high - low
+
+
+def test_tournament_resumes_from_its_file(tmp_path):
+    path = str(tmp_path/'games.jsonl')
+    config_a, config_b = {'agent': 'RandomPlayer'}, {'agent': 'MCTS', 'n_playouts': 5}
+    summary = c4.runTournament(config_a, config_b, 4, path, ROW_COUNT=4, COLUMN_COUNT=4, workers=2)
+    assert summary['games'] == 4 and sum(summary[result]['count'] for result in ('a', 'b', 'draw')) == 4
+    with open(path) as f:
+        first = f.read()
+    with open(path, 'a') as f:
+        f.write('{"game": 5, "a": "Random') #a crash in the middle of a line
+    summary = c4.runTournament(config_a, config_b, 6, path, ROW_COUNT=4, COLUMN_COUNT=4, workers=2)
+    assert summary['games'] == 6
+    with open(path) as f:
+        lines = f.read()
+    assert lines.startswith(first)
+    records = c4.readTournament(path, c4.agentName(config_a), c4.agentName(config_b))
+    assert sorted(records) == list(range(6))
+    assert [records[game]['a_player'] for game in range(6)] == [1, 2, 1, 2, 1, 2]
+
+
+################################################
+#game driver
+
+class FixedPlayer():
+    def __init__(self, column):
+        self.column = column
+
+    def bestMove(self, state, player):
+        return self.column
+
+
+def test_play_game_records_every_move():
+    random.seed(0)
+    game = c4.Connect4(6, 5)
+    rendered = []
+    record = c4.play_game(c4.MCTS(game, 30, 1), c4.RandomPlayer(game, 2), game,
+                          lambda game, move: rendered.append(move))
+    assert rendered == record.moves
+    assert len(record.moves) == game.countMoves(game.state)
+    assert [move.player for move in record.moves] == [1, 2]*(len(record.moves)//2) + [1]*(len(record.moves) % 2)
+    assert all(move.playouts == 30 and move.agent == 'MCTS' for move in record.moves if move.player == 1)
+    assert all(move.playouts is None and move.value is None for move in record.moves if move.player == 2)
+    assert game.checkTerminalState(game.state, record.moves[-1].player) == (True, record.winner)
+
+
+def test_play_game_refuses_invalid_moves():
+    game = c4.Connect4(4, 4)
+    with pytest.raises(ValueError):
+        c4.play_game(FixedPlayer(0), FixedPlayer(7), game)
+
+
+################################################
+#opening book
+
+def test_book_positions_merge_transpositions():
+    assert len(c4.OpeningBook.positions(4, 4, 2)) == 1 + 4
+    assert len(c4.OpeningBook.positions(4, 4, 3)) == 1 + 4 + 16
+    #1-2-3 and 3-2-1 reach the same board
+    assert len(c4.OpeningBook.positions(4, 4, 4)) < 1 + 4 + 16 + 64
+
+
+def test_book_answers_without_searching(tmp_path):
+    path = str(tmp_path/'book.npy')
+    book = c4.OpeningBook.generate(path, ROW_COUNT=4, COLUMN_COUNT=4, depth=2, n_playouts=20, workers=2)
+    assert len(book) == 5
+    assert np.all(np.diff(book.keys.astype(np.float64)) > 0)
+    game = c4.Connect4(4, 4)
+    move = book.lookup(game.positionKey(game.state, 1))
+    assert move in game.validMoves(game.state)
+    assert book.lookup(game.positionKey(game.state, 2)) is None
+    for agent in (c4.MCTS, c4.ArrayMCTS):
+        algo = agent(game, 10**6, 1, book=c4.OpeningBook(path))
+        assert algo.bestMove(game.state, 1) == move and algo.iterations == 0
+
+
+################################################
+#q-table files
+
+@pytest.mark.parametrize('symmetric', [False, True])
+def test_q_table_save_load_round_trip(tmp_path, symmetric):
+    rng = random.Random(0)
+    game = c4.Connect4(3, 5)
+    algo = c4.QLearning(game, 2, symmetric=symmetric)
+    for i in range(40):
+        game, player = randomGame(i, 3, 5, rng.randrange(8))
+        if game is not None:
+            algo.updateQ(game.state, rng.choice(game.validMoves(game.state)), rng.choice([10, -1, -50]))
+    path = str(tmp_path/'table.npy')
+    algo.saveTable(path)
+    loaded = c4.QLearning(c4.Connect4(3, 5), 2, symmetric=symmetric)
+    loaded.loadTable(path)
+    assert len(algo.Q) > 5
+    for key, row in list(algo.Q.items()):
+        assert set(loaded.Q[key]) == set(row)
+        for action, value in row.items():
+            assert loaded.Q[key][action] == pytest.approx(value, rel=1e-6, abs=1e-6)
+        for action, count in algo.N[key].items():
+            assert loaded.N[key][action] == count
+
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_training_applies_every_update_once(workers):
+    algo = c4.QLearning(None, 2)
+    stats = c4.trainQLearning(algo, 3, 5, 10, workers=workers, batch_episodes=5)
+    assert stats['episodes'] == 10
+    assert sum(sum(row.values()) for row in algo.N.values()) == stats['experiences'] > 0
+
+
+def test_training_is_repeatable_for_a_seed():
+    tables = []
+    for i in range(2):
+        algo = c4.QLearning(None, 2)
+        c4.trainQLearning(algo, 3, 5, 10, workers=2, batch_episodes=5)
+        tables.append({key: dict(row) for key, row in algo.Q.items()})
+    assert tables[0] == tables[1]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_dense_training_counts_every_update_once(workers):
+    algo = c4.QLearning(None, 2, dense=c4.DenseQTable.build(3, 5, 2))
+    stats = c4.trainQLearning(algo, 3, 5, 10, workers=workers, batch_episodes=5)
+    assert int(algo.dense.n.sum()) == stats['experiences'] > 0
+
+
+def test_dense_q_table_save_load_round_trip(tmp_path):
+    algo = c4.QLearning(None, 2, dense=c4.DenseQTable.build(3, 5, 2))
+    stats = c4.trainQLearning(algo, 3, 5, 40, workers=2, batch_episodes=20)
+    assert int(algo.dense.n.sum()) == stats['experiences']
+    path = str(tmp_path/'dense.npy')
+    algo.saveTable(path)
+    loaded = c4.QLearning(None, 2, dense=c4.DenseQTable.build(3, 5, 2))
+    loaded.loadTable(path)
+    assert np.array_equal(loaded.dense.n, algo.dense.n)
+    assert np.allclose(loaded.dense.q, algo.dense.q)
+    as_dict = c4.QLearning(c4.Connect4(3, 5), 2)
+    as_dict.loadTable(path)
+    key = int(algo.dense.keys[int(np.argmax(algo.dense.n.sum(axis=1)))])
+    assert list(as_dict.N[key].values()) == [count for count in algo.dense.n[algo.dense.index(key)] if count]
+
+
+################################################
+#benchmarks
+
+def test_compare_to_baseline_flags_only_regressions():
+    baseline = {'ops': {'value': 100.0}, 'latency': {'value': 10.0}, 'old': {'value': 1.0}}
+    metrics = {'ops': {'value': 85.0, 'higher_is_better': True},
+               'latency': {'value': 11.5, 'higher_is_better': False},
+               'new': {'value': 1.0, 'higher_is_better': True}}
+    assert c4.compareToBaseline(metrics, baseline, 0.2) == []
+    assert c4.compareToBaseline(metrics, baseline, 0.1) == [('ops', 85.0, 100.0), ('latency', 11.5, 10.0)]
+    metrics = {'ops': {'value': 200.0, 'higher_is_better': True}, 'latency': {'value': 1.0, 'higher_is_better': False}}
+    assert c4.compareToBaseline(metrics, baseline, 0.0) == []
+
+
+################################################
+#game server
+
+def serve(test, **options):
+    async def run():
+        server = c4.GameServer(workers=1, **options)
+        port = await server.start('127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await test(server, lambda *args: c4.httpRequest(reader, writer, *args))
+        finally:
+            writer.close()
+            await server.close()
+    return asyncio.run(run())
+
+
+#writes data as it is on a new connection to server, returns the statuses of up to count replies
+#(fewer if the server closes the connection)
+async def rawRequests(server, data, count=1):
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.server.sockets[0].getsockname()[1])
+    try:
+        writer.write(data)
+        await writer.drain()
+        statuses = []
+        for i in range(count):
+            message = await c4.readHttpMessage(reader)
+            if message is None:
+                break
+            statuses.append(int(message[0].split(' ')[1]))
+        return statuses
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize('body', [b'[1]', b'"x"', b'5', b'null'])
+def test_server_refuses_bodies_that_are_not_objects(body):
+    async def test(server, request):
+        status, game = await request('POST', '/games', {})
+        for path in ('/games', f"/games/{game['id']}/move"):
+            data = f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+            data += f"GET /games/{game['id']} HTTP/1.1\r\n\r\n".encode() #the connection is still served
+            assert await rawRequests(server, data, 2) == [400, 200]
+        assert len(server.sessions) == 1
+        assert (await request('GET', f"/games/{game['id']}"))[1]['moves'] == 0
+    serve(test)
+
+
+
+@pytest.mark.parametrize('length, status', [('abc', 400), ('-1', 400), ('1.5', 400), ('', 400), ('10000000000', 413)])
+def test_server_checks_content_length(length, status):
+    async def test(server, request):
+        data = f"POST /games HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode()
+        assert await rawRequests(server, data + data, 2) == [status] #the connection is closed after the answer
+        assert not server.sessions
+        assert (await request('POST', '/games', {}))[0] == 200 #other connections are still served
+    serve(test, max_body=1024)
+
+@pytest.mark.parametrize('payload', [{'agent': {'agent': 'MCTSX'}},
+                                     {'agent': {'agent': 'MCTS', 'playouts': 10}},
+                                     {'agent': {'agent': 'MCTS', 'workers': 2}},
+                                     {'agent': {'agent': 'MCTS', 'time_limit': 10}},
+                                     {'agent': {'agent': 'MCTS', 'solver_threshold': 1000}},
+                                     {'agent': {'agent': 'MCTS', 'batch_playouts': 4096}},
+                                     {'agent': {'agent': 'MCTS', 'policy': 'greedy'}},
+                                     {'agent': {'agent': 'RandomPlayer', 'n_playouts': 10}},
+                                     {'agent': {'agent': 'PerfectPlayer'}},
+                                     {'agent': 'MCTS'},
+                                     {'rows': 4000, 'cols': 4000},
+                                     {'rows': 3, 'cols': 3},
+                                     {'rows': 0, 'cols': 5},
+                                     {'player': 3},
+                                     {'player': 2, 'time_limit': -1},
+                                     {'player': 2, 'time_limit': 'nan'}])
+def test_server_refuses_bad_games(payload):
+    async def test(server, request):
+        status, reply = await request('POST', '/games', payload)
+        assert status == 400
+        assert not server.sessions
+    serve(test)
+
+
+def test_server_plays_and_checks_moves():
+    async def test(server, request):
+        status, game = await request('POST', '/games', {'agent': {'agent': 'MCTS', 'policy': 'winblock'}})
+        assert status == 200 and game['moves'] == 0 and game['to_move'] == 1
+        path = f"/games/{game['id']}/move"
+        for payload in ({'column': 9}, {'column': 'x'}, {}, {'column': 0, 'time_limit': -1},
+                        {'column': 0, 'time_limit': 'nan'}, {'column': 0, 'time_limit': 100}):
+            assert (await request('POST', path, payload))[0] == 400
+        status, game = await request('POST', path, {'column': 0, 'time_limit': 0.05})
+        assert status == 200 and game['moves'] == 2 and game['to_move'] == 1
+        server.pending = server.max_pending
+        status, reply = await request('POST', path, {'column': 0, 'time_limit': 0.05})
+        server.pending = 0
+        assert status == 503
+        assert (await request('GET', f"/games/{game['id']}"))[1]['moves'] == 2 #a refused move is not played
+        assert (await request('PUT', f"/games/{game['id']}"))[0] == 405
+        assert (await request('GET', '/players'))[0] == 404
+        assert (await request('DELETE', f"/games/{game['id']}"))[0] == 200
+        assert (await request('GET', f"/games/{game['id']}"))[0] == 404
+    serve(test)
+
+
+def test_server_moves_first_for_player_two():
+    async def test(server, request):
+        status, game = await request('POST', '/games', {'player': 2, 'rows': 4, 'cols': 4, 'time_limit': 0.05})
+        assert status == 200 and game['moves'] == 1 and game['to_move'] == 2
+        assert (await request('POST', '/games', {'player': 3}))[0] == 400
+    serve(test)
+
+
+def test_failed_search_takes_back_the_move():
+    async def run():
+        server = c4.GameServer(workers=1)
+        session = c4.GameSession('0', 6, 5, 1, server.agent)
+        server.sessions['0'] = session
+        session.play(2, 1)
+        server.pending = 1
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(RuntimeError("search crashed"))
+        result = await server.finishSearch(session, future)
+        assert isinstance(result, RuntimeError)
+        assert server.pending == 0 and session.search is None
+        assert session.moves == 0 and session.to_move == 1 and not session.game.state.any()
+        session.play(2, 1) #the move can be sent again
+    asyncio.run(run())
+
+
+def test_load_test_reports_percentiles():
+    result = c4.runLoadTest(games=2, time_limit=0.02, workers=1)
+    assert result['moves'] > 0
+    assert 0 < result['p50'] <= result['p99']
+
+
+def test_load_test_counts_late_moves():
+    result = c4.runLoadTest(games=2, time_limit=0.02, workers=1, grace=0) #every late search gets 504
+    assert result['counts'].get(504, 0) <= result['moves']